@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import seed
+import server
+
+
+async def indexes_command(args) -> int:
+    if args.check:
+        results = await server.check_indexes()
+        for result in results:
+            marker = "COLLSCAN" if result["collection_scan"] else "ok"
+            print(f"{result['collection']:<10} {','.join(result['query']):<32} {' <- '.join(result['stages']):<30} {marker}")
+        return 1 if any(result["collection_scan"] for result in results) else 0
+    print(json.dumps(await server.ensure_indexes(rebuild=True), indent=2))
+    return 0
+
+
+async def migrate_progress_command(args) -> int:
+    print(json.dumps(await server.collapse_progress_duplicates(args.batch_size), indent=2))
+    print(json.dumps(await server.backfill_progress_updated_at(), indent=2))
+    print(json.dumps(await server.ensure_indexes(rebuild=True), indent=2))
+    return 0
+
+
+async def rebuild_rollups_command(args) -> int:
+    print(json.dumps(await server.rebuild_progress_rollups(args.batch_size), indent=2))
+    return 0
+
+
+async def migrate_storage_command(args) -> int:
+    report = await server.migrate_compact_storage(args.batch_size)
+    report["indexes"] = await server.ensure_indexes(rebuild=True)
+    print(json.dumps(report, indent=2))
+    return 1 if report["users_failed"] else 0
+
+
+async def seed_command(args) -> int:
+    config = seed.SeedConfig(
+        seed=args.seed,
+        trainers=args.trainers,
+        sessions=args.sessions,
+        programs=args.programs,
+        users=args.users,
+        progress_per_user=args.progress_per_user,
+        completion_rate=args.completion_rate,
+        history_days=args.history_days,
+        session_popularity_skew=args.popularity_skew,
+        batch_size=args.batch_size,
+        workers=args.workers,
+    )
+    started = time.perf_counter()
+    report = await seed.seed_synthetic(config)
+    if args.rollups:
+        report.update(await server.rebuild_progress_rollups())
+    report["elapsed_s"] = round(time.perf_counter() - started, 2)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+async def export_progress_command(args) -> int:
+    after = None
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        with open(args.checkpoint) as f:
+            after = f.read().strip() or None
+    query = server.progress_export_query(args.since, args.until, after)
+    output = open(args.output, "ab" if after else "wb") if args.output != "-" else sys.stdout.buffer
+    exported = 0
+    started = time.perf_counter()
+    try:
+        async for chunk, checkpoint in server.export_progress(query, args.format, args.batch_size, header=after is None):
+            output.write(chunk)
+            if checkpoint is None:
+                continue
+            exported += chunk.count(b"\n")
+            if args.checkpoint:
+                output.flush()
+                with open(args.checkpoint + ".tmp", "w") as f:
+                    f.write(checkpoint)
+                os.replace(args.checkpoint + ".tmp", args.checkpoint)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+    elapsed = time.perf_counter() - started
+    print(f"exported {exported} rows in {elapsed:.1f}s" + (f", resumed after {after}" if after else ""), file=sys.stderr)
+    return 0
+
+
+async def read_lines(path: str):
+    with open(path, "rb") as f:
+        for line in f:
+            yield line
+
+
+async def import_catalog_command(args) -> int:
+    importer = server.CatalogImport(args.kind, args.dry_run, args.batch_size)
+    report = await importer.run(read_lines(args.path))
+    print(report.model_dump_json(indent=2))
+    return 1 if report.invalid else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Yoga backend maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    indexes = commands.add_parser("indexes", help="Create missing indexes and rebuild ones that differ from the declared definition")
+    indexes.add_argument("--check", action="store_true", help="Explain handler queries and report collection scans")
+    indexes.set_defaults(handler=indexes_command)
+
+    migrate_progress = commands.add_parser(
+        "migrate-progress", help="Collapse duplicate progress rows into one per user and item and backfill updated_at"
+    )
+    migrate_progress.add_argument("--batch-size", type=int, default=1000)
+    migrate_progress.set_defaults(handler=migrate_progress_command)
+
+    rebuild_rollups = commands.add_parser("rebuild-rollups", help="Recompute per-user progress rollups")
+    rebuild_rollups.add_argument("--batch-size", type=int, default=1000)
+    rebuild_rollups.set_defaults(handler=rebuild_rollups_command)
+
+    migrate_storage = commands.add_parser(
+        "migrate-storage", help="Rewrite users and progress into the compact format (run with COMPACT_STORAGE=true)"
+    )
+    migrate_storage.add_argument("--batch-size", type=int, default=1000)
+    migrate_storage.set_defaults(handler=migrate_storage_command)
+
+    synthetic = commands.add_parser("seed", help="Generate a reproducible, production-sized synthetic dataset")
+    synthetic.add_argument("--seed", type=int, default=42, help="Random seed; the same seed yields the same data")
+    synthetic.add_argument("--trainers", type=int, default=200)
+    synthetic.add_argument("--sessions", type=int, default=20000)
+    synthetic.add_argument("--programs", type=int, default=2000)
+    synthetic.add_argument("--users", type=int, default=100000)
+    synthetic.add_argument("--progress-per-user", type=float, default=20.0, help="Mean of the geometric distribution")
+    synthetic.add_argument("--completion-rate", type=float, default=0.6)
+    synthetic.add_argument("--history-days", type=int, default=365)
+    synthetic.add_argument("--popularity-skew", type=float, default=1.1, help="Zipf exponent for session popularity")
+    synthetic.add_argument("--batch-size", type=int, default=5000)
+    synthetic.add_argument("--workers", type=int, default=8, help="Concurrent insert_many batches")
+    synthetic.add_argument("--rollups", action="store_true", help="Rebuild progress rollups afterwards")
+    synthetic.set_defaults(handler=seed_command)
+
+    export = commands.add_parser("export-progress", help="Stream the progress collection as NDJSON or CSV")
+    export.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    export.add_argument("--since", type=datetime.fromisoformat, help="Only rows last changed at or after this time")
+    export.add_argument("--until", type=datetime.fromisoformat, help="Only rows last changed before this time")
+    export.add_argument("--output", default="-", help="File to write, '-' for stdout")
+    export.add_argument(
+        "--checkpoint",
+        help="File holding the position of the last exported row; the next run exports only rows changed since and appends",
+    )
+    export.add_argument("--batch-size", type=int, default=server.EXPORT_BATCH_SIZE)
+    export.set_defaults(handler=export_progress_command)
+
+    catalog_import = commands.add_parser(
+        "import-catalog", help="Validate and upsert trainers, sessions and programs from a JSONL file"
+    )
+    catalog_import.add_argument("path", help="JSONL file, one record per line")
+    catalog_import.add_argument(
+        "--kind", choices=["trainers", "sessions", "programs"], help="Type of records without a 'type' field"
+    )
+    catalog_import.add_argument("--dry-run", action="store_true", help="Validate and report without writing")
+    catalog_import.add_argument("--batch-size", type=int, default=server.IMPORT_BATCH_SIZE)
+    catalog_import.set_defaults(handler=import_catalog_command)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    server.init_db()
+    try:
+        return asyncio.run(args.handler(args))
+    finally:
+        server.close_db()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
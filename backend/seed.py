@@ -0,0 +1,241 @@
+import asyncio
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import numpy as np
+from pymongo.errors import BulkWriteError
+
+import server
+
+DUPLICATE_KEY = 11000
+SYNTHETIC_NAMESPACE = uuid.UUID("6f1d3c52-8a4e-4f3b-9a57-3d2f0c9b7e11")
+DEMO_PASSWORD = "password123"
+
+FIRST_NAMES = ["Annie", "David", "Lisa", "Sarah", "Maya", "Arjun", "Priya", "Tom", "Elena", "Kenji", "Amara", "Luca"]
+LAST_NAMES = ["John", "Mary", "Chen", "Patel", "Garcia", "Kim", "Nguyen", "Rossi", "Okafor", "Silva", "Sharma", "Berg"]
+TITLE_WORDS = {
+    "Yoga": ["Vinyasa", "Hatha", "Yin", "Power", "Morning", "Restorative", "Flow", "Stretch", "Balance", "Core"],
+    "Meditation": ["Mindfulness", "Breathing", "Body Scan", "Loving Kindness", "Focus", "Calm", "Gratitude"],
+    "Sleep": ["Deep Sleep", "Wind Down", "Bedtime", "Night Rain", "Dream", "Slow Breath", "Evening"],
+    "Pilates": ["Mat", "Core", "Reformer", "Posture", "Strength"],
+    "Breathwork": ["Box Breathing", "Pranayama", "Energizing", "Calming", "Alternate Nostril"],
+}
+IMAGES = [
+    "https://images.unsplash.com/photo-1662302392561-b1deecd3579d?crop=entropy&cs=srgb&fm=jpg&q=85",
+    "https://images.unsplash.com/photo-1755549476788-efd8bf819561?crop=entropy&cs=srgb&fm=jpg&q=85",
+    "https://images.unsplash.com/photo-1638244398513-17b778d24efe?crop=entropy&cs=srgb&fm=jpg&q=85",
+    "https://images.unsplash.com/photo-1660171465646-23a749459e74?crop=entropy&cs=srgb&fm=jpg&q=85",
+    "https://images.unsplash.com/photo-1729886484969-188f0d7f196c?crop=entropy&cs=srgb&fm=jpg&q=85",
+]
+
+
+@dataclass
+class SeedConfig:
+    seed: int = 42
+    trainers: int = 200
+    sessions: int = 20000
+    programs: int = 2000
+    users: int = 100000
+    progress_per_user: float = 20.0
+    completion_rate: float = 0.6
+    history_days: int = 365
+    category_weights: Dict[str, float] = field(default_factory=lambda: {
+        "Yoga": 0.45, "Meditation": 0.25, "Sleep": 0.15, "Pilates": 0.1, "Breathwork": 0.05,
+    })
+    durations: List[int] = field(default_factory=lambda: [5, 10, 15, 20, 30, 45, 60])
+    duration_weights: List[float] = field(default_factory=lambda: [0.1, 0.2, 0.2, 0.2, 0.15, 0.1, 0.05])
+    session_popularity_skew: float = 1.1
+    batch_size: int = 5000
+    workers: int = 8
+
+
+def synthetic_id(config: SeedConfig, kind: str, index: int) -> str:
+    return str(uuid.uuid5(SYNTHETIC_NAMESPACE, f"{config.seed}:{kind}:{index}"))
+
+
+def chunk_rng(config: SeedConfig, kind: str, chunk: int) -> np.random.Generator:
+    return np.random.default_rng([config.seed, sum(kind.encode()), chunk])
+
+
+def zipf_weights(count: int, skew: float) -> np.ndarray:
+    weights = 1.0 / np.power(np.arange(1, count + 1), skew)
+    return weights / weights.sum()
+
+
+def build_trainers(config: SeedConfig) -> List[dict]:
+    rng = chunk_rng(config, "trainers", 0)
+    categories = list(config.category_weights)
+    return [
+        {
+            "id": synthetic_id(config, "trainer", i),
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "bio": f"Certified instructor with {int(rng.integers(2, 25))}+ years of experience",
+            "image": IMAGES[i % len(IMAGES)],
+            "specialization": str(rng.choice(categories)),
+        }
+        for i in range(config.trainers)
+    ]
+
+
+def build_sessions(config: SeedConfig, trainers: List[dict]) -> List[dict]:
+    rng = chunk_rng(config, "sessions", 0)
+    categories = list(config.category_weights)
+    category_p = np.array(list(config.category_weights.values()))
+    category_idx = rng.choice(len(categories), size=config.sessions, p=category_p / category_p.sum())
+    trainer_idx = rng.choice(len(trainers), size=config.sessions, p=zipf_weights(len(trainers), 0.8))
+    duration_p = np.array(config.duration_weights)
+    durations = rng.choice(config.durations, size=config.sessions, p=duration_p / duration_p.sum())
+    sessions = []
+    for i in range(config.sessions):
+        category = categories[category_idx[i]]
+        trainer = trainers[trainer_idx[i]]
+        sessions.append({
+            "id": synthetic_id(config, "session", i),
+            "title": f"{rng.choice(TITLE_WORDS[category])} {category} {i}",
+            "trainer_id": trainer["id"],
+            "trainer_name": trainer["name"],
+            "trainer_image": trainer["image"],
+            "category": category,
+            "duration": int(durations[i]),
+            "description": f"A {int(durations[i])}-minute {category.lower()} session with {trainer['name']}",
+            "image": IMAGES[i % len(IMAGES)],
+            "video_url": f"https://example.com/video/{i}",
+        })
+    return sessions
+
+
+def build_programs(config: SeedConfig, sessions: List[dict]) -> List[dict]:
+    rng = chunk_rng(config, "programs", 0)
+    schedule_rng = chunk_rng(config, "schedules", 0)
+    categories = list(config.category_weights)
+    category_sessions = {}
+    for session in sessions:
+        category_sessions.setdefault(session["category"], []).append(session["id"])
+    programs = []
+    for i in range(config.programs):
+        category = str(rng.choice(categories))
+        days = int(rng.choice([7, 10, 14, 21, 30]))
+        pool = category_sessions.get(category, [])
+        picked = schedule_rng.choice(len(pool), size=days) if pool else []
+        programs.append({
+            "id": synthetic_id(config, "program", i),
+            "title": f"{days}-Day {rng.choice(TITLE_WORDS[category])} {category} Program {i}",
+            "description": f"A {days}-day {category.lower()} program",
+            "image": IMAGES[i % len(IMAGES)],
+            "duration_days": days,
+            "start_date": None,
+            "end_date": None,
+            "category": category,
+            "sessions_count": days,
+            "schedule": [{"day": day + 1, "session_id": pool[idx]} for day, idx in enumerate(picked)],
+        })
+    return programs
+
+
+def build_user_chunk(config: SeedConfig, chunk: int, password_hash: str, created_base: datetime) -> List[dict]:
+    rng = chunk_rng(config, "users", chunk)
+    start = chunk * config.batch_size
+    end = min(start + config.batch_size, config.users)
+    users = []
+    for i in range(start, end):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        users.append({
+            "id": synthetic_id(config, "user", i),
+            "email": f"{first.lower()}.{last.lower()}.{i}@synthetic.yoga",
+            "name": f"{first} {last}",
+            "profile_image": f"https://api.dicebear.com/7.x/avataaars/svg?seed={i}",
+            "is_premium": bool(rng.random() < 0.15),
+            "created_at": (created_base - timedelta(seconds=int(rng.integers(0, config.history_days * 86400)))).isoformat(),
+            "password": password_hash,
+        })
+    return users
+
+
+def build_progress_chunk(config: SeedConfig, chunk: int, session_ids: List[str], session_p: np.ndarray, now: datetime) -> List[dict]:
+    rng = chunk_rng(config, "progress", chunk)
+    start = chunk * config.batch_size
+    end = min(start + config.batch_size, config.users)
+    counts = rng.geometric(1.0 / max(config.progress_per_user, 1.0), size=end - start)
+    rows = []
+    for offset, count in enumerate(counts):
+        user_id = synthetic_id(config, "user", start + offset)
+        picked = np.unique(rng.choice(len(session_ids), size=min(int(count), len(session_ids)), p=session_p))
+        completed = rng.random(picked.size) < config.completion_rate
+        ages = rng.integers(0, config.history_days * 86400, size=picked.size)
+        for session_idx, is_completed, age in zip(picked, completed, ages):
+            session_id = session_ids[session_idx]
+            rows.append({
+                "id": str(uuid.uuid5(SYNTHETIC_NAMESPACE, f"{user_id}:{session_id}")),
+                "user_id": user_id,
+                "session_id": session_id,
+                "program_id": None,
+                "completed": bool(is_completed),
+                "completed_at": (now - timedelta(seconds=int(age))).isoformat() if is_completed else None,
+                "progress_percentage": 100 if is_completed else int(rng.integers(5, 95)),
+                "updated_at": now - timedelta(seconds=int(age)),
+            })
+    return rows
+
+
+async def insert_unordered(collection, documents: List[dict]) -> int:
+    if not documents:
+        return 0
+    try:
+        result = await collection.insert_many(documents, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+            raise
+        return e.details["nInserted"]
+
+
+async def insert_chunks(collection, chunks: int, build_chunk, workers: int) -> int:
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run(chunk):
+        async with semaphore:
+            documents = await asyncio.to_thread(build_chunk, chunk)
+            return await insert_unordered(collection, documents)
+
+    return sum(await asyncio.gather(*(run(chunk) for chunk in range(chunks))))
+
+
+async def seed_synthetic(config: SeedConfig, progress_callback=print) -> dict:
+    await server.ensure_indexes()
+    now = datetime(2026, 1, 1, tzinfo=timezone.utc) + timedelta(days=config.seed % 365)
+
+    trainers = build_trainers(config)
+    sessions = build_sessions(config, trainers)
+    programs = build_programs(config, sessions)
+    report = {
+        "trainers": await insert_unordered(server.db.trainers, trainers),
+        "sessions": sum([
+            await insert_unordered(server.db.sessions, sessions[i:i + config.batch_size])
+            for i in range(0, len(sessions), config.batch_size)
+        ]),
+        "programs": await insert_unordered(server.db.programs, programs),
+    }
+    if any(report.values()):
+        await server.bump_catalog_version()
+    progress_callback(f"catalog: {report}")
+
+    chunks = (config.users + config.batch_size - 1) // config.batch_size
+    password_hash = server.hash_password(DEMO_PASSWORD)
+
+    def user_chunk(chunk):
+        return [server.user_to_storage(user) for user in build_user_chunk(config, chunk, password_hash, now)]
+
+    report["users"] = await insert_chunks(server.db.users, chunks, user_chunk, config.workers)
+    progress_callback(f"users: {report['users']}")
+
+    session_ids = [session["id"] for session in sessions]
+    session_p = zipf_weights(len(session_ids), config.session_popularity_skew)
+
+    def progress_chunk(chunk):
+        return [server.progress_to_storage(row) for row in build_progress_chunk(config, chunk, session_ids, session_p, now)]
+
+    report["progress"] = await insert_chunks(server.db.progress, chunks, progress_chunk, config.workers)
+    progress_callback(f"progress: {report['progress']}")
+    return report
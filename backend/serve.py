@@ -0,0 +1,39 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import uvicorn
+
+BACKEND_DIR = Path(__file__).parent
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Run the Yoga API with one or more worker processes")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8001)))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        help="Worker processes; each opens its own Mongo connection pool after it starts",
+    )
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="Seconds to drain requests on shutdown")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    uvicorn.run(
+        "server:app",
+        app_dir=str(BACKEND_DIR),
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level=args.log_level,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
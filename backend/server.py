@@ -1,18 +1,50 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, status
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, DeleteMany, IndexModel, ReturnDocument, UpdateMany, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from bson import Binary, ObjectId
+from bson.binary import UUID_SUBTYPE
+from bson.errors import InvalidId
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, model_validator
 from typing import List, Optional
+import asyncio
+import base64
+import csv
+import hmac
+import io
+import json
+import re
+import threading
+import time
 import uuid
-from datetime import datetime, timezone, timedelta
+import zlib
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timezone, timedelta
 import jwt
+import numpy as np
 from passlib.context import CryptContext
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -20,43 +52,1044 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'yoga-wellness-secret-key-change-in-pr
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+CLAIMS_TOKENS_ENABLED = os.environ.get('CLAIMS_TOKENS_ENABLED', 'false').lower() == 'true'
+CLAIMS_VERSION = 1
+CLAIMS_FIELDS = ("name", "email", "is_premium")
+CLAIMS_ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('CLAIMS_ACCESS_TOKEN_EXPIRE_MINUTES', 15))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', 30))
+
+PASSWORD_HASH_EXECUTOR = os.environ.get('PASSWORD_HASH_EXECUTOR', 'thread')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', PASSWORD_HASH_WORKERS * 8))
+
+AUTH_RATE_LIMIT_BACKEND = os.environ.get('AUTH_RATE_LIMIT_BACKEND', 'memory')
+AUTH_RATE_LIMIT_IP_PER_MINUTE = float(os.environ.get('AUTH_RATE_LIMIT_IP_PER_MINUTE', 30))
+AUTH_RATE_LIMIT_IP_BURST = float(os.environ.get('AUTH_RATE_LIMIT_IP_BURST', 10))
+AUTH_RATE_LIMIT_EMAIL_PER_MINUTE = float(os.environ.get('AUTH_RATE_LIMIT_EMAIL_PER_MINUTE', 5))
+AUTH_RATE_LIMIT_EMAIL_BURST = float(os.environ.get('AUTH_RATE_LIMIT_EMAIL_BURST', 5))
+AUTH_RATE_LIMIT_MAX_KEYS = int(os.environ.get('AUTH_RATE_LIMIT_MAX_KEYS', 100000))
+TRUST_FORWARDED_FOR = os.environ.get('TRUST_FORWARDED_FOR', 'false').lower() == 'true'
+
+AUTO_CREATE_INDEXES = os.environ.get('AUTO_CREATE_INDEXES', 'true').lower() == 'true'
+COMPACT_STORAGE = os.environ.get('COMPACT_STORAGE', 'false').lower() == 'true'
+
+USER_CACHE_ENABLED = os.environ.get('USER_CACHE_ENABLED', 'true').lower() == 'true'
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+
+CATALOG_REFRESH_SECONDS = float(os.environ.get('CATALOG_REFRESH_SECONDS', 5))
+PROGRAM_DETAIL_CACHE_SIZE = int(os.environ.get('PROGRAM_DETAIL_CACHE_SIZE', 1000))
+
+CATALOG_CACHE_CONTROL = os.environ.get('CATALOG_CACHE_CONTROL', 'public, max-age=60')
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get('COMPRESSION_MINIMUM_SIZE', 1024))
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+MISSING_IDS_HEADER_MAX_BYTES = int(os.environ.get('MISSING_IDS_HEADER_MAX_BYTES', 2048))
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+SEARCH_MIN_PREFIX_LENGTH = int(os.environ.get('SEARCH_MIN_PREFIX_LENGTH', 2))
+SEARCH_MAX_PREFIX_TOKENS = int(os.environ.get('SEARCH_MAX_PREFIX_TOKENS', 256))
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 4096))
+RECOMMENDATION_MAX_NEIGHBOURS = int(os.environ.get('RECOMMENDATION_MAX_NEIGHBOURS', 2000))
+RECOMMENDATION_REFRESH_SECONDS = float(os.environ.get('RECOMMENDATION_REFRESH_SECONDS', 900))
+RECOMMENDATION_CACHE_SIZE = int(os.environ.get('RECOMMENDATION_CACHE_SIZE', 10000))
+RECOMMENDATION_CACHE_TTL_SECONDS = float(os.environ.get('RECOMMENDATION_CACHE_TTL_SECONDS', 3600))
+
+FAST_JSON_RESPONSES = os.environ.get('FAST_JSON_RESPONSES', 'false').lower() == 'true' and orjson is not None
+
+PROGRESS_WRITE_BEHIND = os.environ.get('PROGRESS_WRITE_BEHIND', 'true').lower() == 'true'
+PROGRESS_FLUSH_SECONDS = float(os.environ.get('PROGRESS_FLUSH_SECONDS', 2))
+PROGRESS_BUFFER_MAX_ITEMS = int(os.environ.get('PROGRESS_BUFFER_MAX_ITEMS', 5000))
+PROGRESS_BUFFER_REJECT_FACTOR = int(os.environ.get('PROGRESS_BUFFER_REJECT_FACTOR', 4))
+PROGRESS_BATCH_MAX_ITEMS = int(os.environ.get('PROGRESS_BATCH_MAX_ITEMS', 500))
+
+LEADERBOARD_CHECKPOINT_SECONDS = float(os.environ.get('LEADERBOARD_CHECKPOINT_SECONDS', 10))
+LEADERBOARD_MAX_LIMIT = int(os.environ.get('LEADERBOARD_MAX_LIMIT', 100))
+
+ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY', '')
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 5000))
+EXPORT_SETTLE_SECONDS = float(os.environ.get('EXPORT_SETTLE_SECONDS', 5))
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', 1000))
+
+WARM_CATALOG_ON_STARTUP = os.environ.get('WARM_CATALOG_ON_STARTUP', 'true').lower() == 'true'
+READINESS_PING_TIMEOUT_SECONDS = float(os.environ.get('READINESS_PING_TIMEOUT_SECONDS', 2))
+
 security = HTTPBearer()
+_pwd_context = None
+
+def password_context() -> CryptContext:
+    # Built on first use so every worker process (and process-pool child) gets its own
+    global _pwd_context
+    if _pwd_context is None:
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+
+    def render(self, name: str, labels: str) -> List[str]:
+        lines, cumulative = [], 0
+        prefix = labels + "," if labels else ""
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+class Metrics:
+    def __init__(self):
+        self.http_latency = {}
+        self.http_responses = {}
+        self.http_in_flight = {}
+        self.mongo_latency = {}
+        self.mongo_failures = {}
+        self.password_latency = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe_http(self, method: str, route: str, status_code: int, seconds: float):
+        key = (method, route)
+        histogram = self.http_latency.get(key)
+        if histogram is None:
+            histogram = self.http_latency[key] = Histogram()
+        histogram.observe(seconds)
+        response_key = (method, route, status_code)
+        self.http_responses[response_key] = self.http_responses.get(response_key, 0) + 1
+
+    def observe_mongo(self, collection: str, command: str, seconds: float, failed: bool = False):
+        key = (collection, command)
+        with self._lock:
+            histogram = self.mongo_latency.get(key)
+            if histogram is None:
+                histogram = self.mongo_latency[key] = Histogram()
+            histogram.observe(seconds)
+            if failed:
+                self.mongo_failures[key] = self.mongo_failures.get(key, 0) + 1
+
+    def observe_password(self, operation: str, seconds: float):
+        with self._lock:
+            histogram = self.password_latency.get(operation)
+            if histogram is None:
+                histogram = self.password_latency[operation] = Histogram()
+            histogram.observe(seconds)
+
+    def gauge(self, name: str, collect):
+        self.gauges[name] = collect
+
+    def render(self) -> str:
+        lines = ["# TYPE http_request_duration_seconds histogram"]
+        for (method, route), histogram in sorted(self.http_latency.items()):
+            lines += histogram.render("http_request_duration_seconds", f'method="{method}",route="{route}"')
+        lines.append("# TYPE http_responses_total counter")
+        for (method, route, status_code), count in sorted(self.http_responses.items()):
+            lines.append(f'http_responses_total{{method="{method}",route="{route}",status="{status_code}"}} {count}')
+        lines.append("# TYPE http_requests_in_flight gauge")
+        for method, count in sorted(self.http_in_flight.items()):
+            lines.append(f'http_requests_in_flight{{method="{method}"}} {count}')
+        with self._lock:
+            lines.append("# TYPE mongo_command_duration_seconds histogram")
+            for (collection, command), histogram in sorted(self.mongo_latency.items()):
+                lines += histogram.render("mongo_command_duration_seconds", f'collection="{collection}",command="{command}"')
+            lines.append("# TYPE mongo_command_failures_total counter")
+            for (collection, command), count in sorted(self.mongo_failures.items()):
+                lines.append(f'mongo_command_failures_total{{collection="{collection}",command="{command}"}} {count}')
+            lines.append("# TYPE password_hash_duration_seconds histogram")
+            for operation, histogram in sorted(self.password_latency.items()):
+                lines += histogram.render("password_hash_duration_seconds", f'operation="{operation}"')
+        for name, collect in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.append(f"{name} {collect()}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        # getMore names its cursor id, not its collection
+        name = "collection" if event.command_name == "getMore" else event.command_name
+        collection = event.command.get(name)
+        self._pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), "")
+        metrics.observe_mongo(collection, event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), "")
+        metrics.observe_mongo(collection, event.command_name, event.duration_micros / 1e6, failed=True)
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method = scope["method"]
+        status_code = 500
+        in_flight = metrics.http_in_flight
+        in_flight[method] = in_flight.get(method, 0) + 1
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight[method] -= 1
+            route = scope.get("route")
+            metrics.observe_http(method, route.path if route is not None else "unmatched", status_code, time.perf_counter() - started)
 
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = None
+db = None
+
+def init_db():
+    # The Motor client starts monitor threads as soon as it is built, so it must be created
+    # inside each worker after fork rather than at import time
+    global client, db
+    if client is None:
+        client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMetrics()])
+        db = client[os.environ['DB_NAME']]
+    return db
+
+def close_db():
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
 
-app = FastAPI()
 api_router = APIRouter(prefix="/api")
+ops_router = APIRouter()
+
+REQUIRED_INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # In compact storage the id lives in _id; this only covers documents not migrated yet
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True, partialFilterExpression={"id": {"$exists": True}})
+        if COMPACT_STORAGE else IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "trainers": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "sessions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("category", ASCENDING)], name="category"),
+        IndexModel([("trainer_id", ASCENDING)], name="trainer_id"),
+    ],
+    "programs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "progress_rollups": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("last_practice_date", ASCENDING)], name="last_practice_date"),
+    ],
+    "leaderboard": [
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "progress": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("user_id", ASCENDING), ("session_id", ASCENDING), ("program_id", ASCENDING)],
+            name="user_item_unique",
+            unique=True,
+        ),
+        IndexModel([("user_id", ASCENDING), ("completed_at", DESCENDING)], name="user_id_completed_at"),
+        IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)], name="user_id__id"),
+        IndexModel([("updated_at", ASCENDING), ("_id", ASCENDING)], name="updated_at__id"),
+    ],
+}
+
+QUERY_SHAPES = [
+    ("users", {"email": "probe@example.com"}),
+    ("users", {"id": "probe"}),
+    ("sessions", {"id": "probe"}),
+    ("sessions", {"category": "probe"}),
+    ("sessions", {"trainer_id": "probe"}),
+    ("programs", {"id": "probe"}),
+    ("progress_rollups", {"last_practice_date": {"$gte": "2024-01-01"}}),
+    ("progress", {"user_id": "probe"}),
+    ("progress", {"user_id": "probe", "session_id": "probe", "program_id": None}),
+    ("progress", {"user_id": "probe", "_id": {"$gt": ObjectId("000000000000000000000000")}}),
+    ("progress", {"updated_at": {"$gte": datetime(2024, 1, 1)}}),
+]
+
+def _index_matches(existing: dict, wanted: dict) -> bool:
+    return (
+        list(existing["key"]) == list(wanted["key"].items())
+        and bool(existing.get("unique", False)) == bool(wanted.get("unique", False))
+        and existing.get("partialFilterExpression") == wanted.get("partialFilterExpression")
+    )
+
+async def ensure_indexes(rebuild: bool = False) -> dict:
+    # Workers only create missing indexes; dropping a mismatched one (and the window without a
+    # unique constraint that opens) is left to `manage.py indexes`, which passes rebuild=True
+    report = {}
+    for collection_name, models in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        created, rebuilt, mismatched, failed = [], [], [], []
+        try:
+            existing = await collection.index_information()
+        except OperationFailure as e:
+            logger.error("Could not list indexes on %s: %s", collection_name, e)
+            report[collection_name] = {"created": created, "rebuilt": rebuilt, "mismatched": mismatched,
+                                       "failed": [model.document["name"] for model in models], "undeclared": []}
+            continue
+        for model in models:
+            wanted = model.document
+            name = wanted["name"]
+            try:
+                if name in existing:
+                    if _index_matches(existing[name], wanted):
+                        continue
+                    if not rebuild:
+                        mismatched.append(name)
+                        continue
+                    try:
+                        await collection.drop_index(name)
+                    except OperationFailure as e:
+                        # Another process dropped it first
+                        if e.code != 27:
+                            raise
+                    rebuilt.append(name)
+                await collection.create_indexes([model])
+            except OperationFailure as e:
+                logger.error("Could not create index %s on %s: %s", name, collection_name, e)
+                failed.append(name)
+                continue
+            if name not in rebuilt:
+                created.append(name)
+        if mismatched:
+            logger.warning(
+                "Indexes on %s differ from the declared ones: %s; run `manage.py indexes` to rebuild them",
+                collection_name, ", ".join(mismatched),
+            )
+        declared = {model.document["name"] for model in models} | {"_id_"}
+        undeclared = sorted(set(existing) - declared)
+        if undeclared:
+            logger.warning("Undeclared indexes on %s: %s", collection_name, ", ".join(undeclared))
+        report[collection_name] = {
+            "created": created, "rebuilt": rebuilt, "mismatched": mismatched, "failed": failed, "undeclared": undeclared,
+        }
+    return report
+
+def _plan_stages(plan: dict):
+    yield plan.get("stage")
+    if "inputStage" in plan:
+        yield from _plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+async def check_indexes() -> List[dict]:
+    results = []
+    for collection_name, query in QUERY_SHAPES:
+        explain = await db[collection_name].find(query).explain()
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        stages = [stage for stage in _plan_stages(winning_plan) if stage]
+        results.append({
+            "collection": collection_name,
+            "query": sorted(query),
+            "stages": stages,
+            "collection_scan": "COLLSCAN" in stages,
+        })
+    return results
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    started = time.perf_counter()
+    hashed = password_context().hash(password)
+    metrics.observe_password("hash", time.perf_counter() - started)
+    return hashed
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    started = time.perf_counter()
+    verified = password_context().verify(plain_password, hashed_password)
+    metrics.observe_password("verify", time.perf_counter() - started)
+    return verified
+
+class PasswordHasher:
+    def __init__(self, kind: str, workers: int, max_pending: int):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None and self.workers > 0:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def run(self, func, *args):
+        if self.workers <= 0:
+            return func(*args)
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Authentication service busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+password_hasher = PasswordHasher(PASSWORD_HASH_EXECUTOR, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+def to_storage_id(value):
+    if not COMPACT_STORAGE or not isinstance(value, str):
+        return value
+    try:
+        return Binary.from_uuid(uuid.UUID(value))
+    except ValueError:
+        return value
+
+def from_storage_id(value):
+    if isinstance(value, Binary) and value.subtype == UUID_SUBTYPE:
+        return str(value.as_uuid())
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+def to_storage_time(value):
+    if not COMPACT_STORAGE or not isinstance(value, str):
+        return value
+    return datetime.fromisoformat(value)
+
+def from_storage_time(value):
+    if isinstance(value, datetime):
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
+    return value
+
+def storage_now():
+    now = datetime.now(timezone.utc)
+    if COMPACT_STORAGE:
+        # Truncated to BSON date precision so the value written compares equal to the value read back
+        return now.replace(microsecond=now.microsecond // 1000 * 1000, tzinfo=None)
+    return now.isoformat()
+
+def storage_day(value) -> str:
+    return from_storage_time(value)[:10]
+
+def _naive_utc(value: datetime) -> datetime:
+    # BSON dates are UTC; naive values are taken to be UTC already
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+def user_to_storage(user: dict) -> dict:
+    if not COMPACT_STORAGE:
+        return user
+    stored = {key: value for key, value in user.items() if key not in ("id", "_id")}
+    stored["_id"] = to_storage_id(user["id"])
+    if "created_at" in user:
+        stored["created_at"] = to_storage_time(user["created_at"])
+    return stored
+
+def user_from_storage(doc: Optional[dict]) -> Optional[dict]:
+    if doc is None:
+        return None
+    user = dict(doc)
+    stored_id = user.pop("_id", None)
+    if "id" not in user:
+        user = {"id": from_storage_id(stored_id), **user}
+    if "created_at" in user:
+        user["created_at"] = from_storage_time(user["created_at"])
+    return user
+
+def user_id_filter(user_ids: List[str]) -> dict:
+    if not COMPACT_STORAGE:
+        return {"id": {"$in": user_ids}}
+    # Matches migrated documents by _id and not-yet-migrated ones through the partial id index
+    return {"$or": [{"_id": {"$in": [to_storage_id(user_id) for user_id in user_ids]}}, {"id": {"$in": user_ids}}]}
+
+def progress_to_storage(progress: dict) -> dict:
+    if not COMPACT_STORAGE:
+        return progress
+    return {**progress, "id": to_storage_id(progress["id"]), "completed_at": to_storage_time(progress.get("completed_at"))}
+
+def progress_from_storage(doc: dict) -> dict:
+    if "id" in doc:
+        doc["id"] = from_storage_id(doc["id"])
+    if "completed_at" in doc:
+        doc["completed_at"] = from_storage_time(doc["completed_at"])
+    return doc
+
+class LRUCache:
+    # Least-recently-used eviction; entries also expire after ttl_seconds unless it is None
+    def __init__(self, enabled: bool, max_size: int, ttl_seconds: Optional[float] = None):
+        self.enabled = enabled and max_size > 0
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+user_cache = LRUCache(USER_CACHE_ENABLED, USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
+class SingleFlight:
+    # Concurrent calls with the same key share one in-flight coroutine and its result
+    def __init__(self):
+        self.calls = 0
+        self.executed = 0
+        self._inflight = {}
+
+    async def do(self, key, func):
+        self.calls += 1
+        future = self._inflight.get(key)
+        if future is None:
+            self.executed += 1
+            future = asyncio.ensure_future(func())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._release(key, done))
+        return await asyncio.shield(future)
+
+    def _release(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+class BatchLoader:
+    # DataLoader-style: loads requested in the same event loop tick go out as one $in query,
+    # and a key already being fetched joins that query instead of sending its own
+    def __init__(self, collection_name: str, key: str = "id", projection: Optional[dict] = None, max_batch: int = 1000):
+        self.collection_name = collection_name
+        self.key = key
+        self.projection = projection
+        self.max_batch = max_batch
+        self.requests = 0
+        self.queries = 0
+        self._pending = {}
+        self._inflight = {}
+
+    async def load(self, value) -> Optional[dict]:
+        self.requests += 1
+        future = self._inflight.get(value) or self._pending.get(value)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            if not self._pending:
+                asyncio.get_running_loop().call_soon(self._dispatch)
+            self._pending[value] = future
+        return await asyncio.shield(future)
+
+    def forget(self, value):
+        self._inflight.pop(value, None)
 
-def create_access_token(data: dict) -> str:
+    def _dispatch(self):
+        pending, self._pending = self._pending, {}
+        values = list(pending)
+        for start in range(0, len(values), self.max_batch):
+            batch = {value: pending[value] for value in values[start:start + self.max_batch]}
+            self._inflight.update(batch)
+            asyncio.ensure_future(self._fetch(batch))
+
+    async def _fetch(self, batch: dict):
+        self.queries += 1
+        try:
+            docs = await db[self.collection_name].find(self.query(list(batch)), self.projection).to_list(None)
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            for value, future in batch.items():
+                if self._inflight.get(value) is future:
+                    del self._inflight[value]
+        found = {self.doc_key(doc): doc for doc in docs}
+        for value, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(value))
+
+    def query(self, values: list) -> dict:
+        return {self.key: {"$in": values}}
+
+    def doc_key(self, doc: dict):
+        return doc[self.key]
+
+class UserLoader(BatchLoader):
+    def query(self, values: list) -> dict:
+        return user_id_filter(values)
+
+    def doc_key(self, doc: dict):
+        return doc["id"] if "id" in doc else from_storage_id(doc["_id"])
+
+user_loader = UserLoader("users")
+
+# Code that rewrites a user document must call user_loader.forget and user_cache.invalidate
+# with its id afterwards, as migrate_compact_storage does
+async def load_user(user_id: str) -> Optional[dict]:
+    user = user_cache.get(user_id)
+    if user is None:
+        user = user_from_storage(await user_loader.load(user_id))
+        if user is not None:
+            user_cache.set(user_id, user)
+    return user
+
+class CatalogSnapshot:
+    def __init__(self, version: int, trainers: List[dict], sessions: List[dict], programs: List[dict]):
+        self.version = version
+        self.trainers = sorted(trainers, key=lambda doc: doc["id"])
+        self.sessions = sorted(sessions, key=lambda doc: doc["id"])
+        self.programs = sorted(programs, key=lambda doc: doc["id"])
+        self.trainers_by_id = {trainer["id"]: trainer for trainer in trainers}
+        self.sessions_by_id = {session["id"]: session for session in sessions}
+        self.programs_by_id = {program["id"]: program for program in programs}
+        self.sessions_by_category = {}
+        for session in self.sessions:
+            self.sessions_by_category.setdefault(session["category"], []).append(session)
+
+class CatalogCache:
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self.snapshot = None
+        self.loads = 0
+        self.listeners = []
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    async def get(self) -> CatalogSnapshot:
+        snapshot = self.snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.refresh_seconds:
+            return snapshot
+        async with self._lock:
+            if self.snapshot is not None and time.monotonic() - self._checked_at < self.refresh_seconds:
+                return self.snapshot
+            version = await get_catalog_version()
+            if self.snapshot is None or self.snapshot.version != version:
+                self.snapshot = await self.load(version)
+                for listener in self.listeners:
+                    listener(self.snapshot)
+            self._checked_at = time.monotonic()
+            return self.snapshot
+
+    async def load(self, version: int) -> CatalogSnapshot:
+        trainers, sessions, programs = await asyncio.gather(
+            db.trainers.find({}, {"_id": 0}).to_list(None),
+            db.sessions.find({}, {"_id": 0}).to_list(None),
+            db.programs.find({}, {"_id": 0}).to_list(None),
+        )
+        self.loads += 1
+        return CatalogSnapshot(
+            version,
+            [Trainer.model_validate(doc).model_dump() for doc in trainers],
+            [Session.model_validate(doc).model_dump() for doc in sessions],
+            [Program.model_validate(doc).model_dump() for doc in programs],
+        )
+
+    def invalidate(self):
+        self._checked_at = 0.0
+
+catalog_cache = CatalogCache(CATALOG_REFRESH_SECONDS)
+
+SEARCH_FIELD_WEIGHTS = {"title": 3.0, "trainer_name": 2.0, "category": 2.0, "description": 1.0}
+SEARCH_TOKEN_RE = re.compile(r"[a-z0-9]+")
+SEARCH_MAX_LIMIT = 100
+
+def tokenize(text: str) -> List[str]:
+    return SEARCH_TOKEN_RE.findall(text.lower())
+
+class SearchIndex:
+    def __init__(self, min_prefix_length: int, max_prefix_tokens: int, cache_size: int):
+        self.min_prefix_length = min_prefix_length
+        self.max_prefix_tokens = max_prefix_tokens
+        self.docs = {}
+        self.postings = {}
+        self.tokens = []
+        self._doc_tokens = {}
+        self._keys_by_kind = {"session": set(), "program": set()}
+        self._title_order = None
+        # Ranked top SEARCH_MAX_LIMIT per (terms, kind); any change to the index drops it
+        self._results = LRUCache(True, cache_size)
+
+    def add(self, key: tuple, doc: dict):
+        self.remove(key)
+        weights = {}
+        for field, weight in SEARCH_FIELD_WEIGHTS.items():
+            for token in tokenize(doc.get(field) or ""):
+                weights[token] = weights.get(token, 0.0) + weight
+        for token, weight in weights.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                insort(self.tokens, token)
+            posting[key] = weight
+        self.docs[key] = doc
+        self._doc_tokens[key] = weights
+        self._keys_by_kind[key[0]].add(key)
+        self._changed()
+
+    def remove(self, key: tuple):
+        for token in self._doc_tokens.pop(key, {}):
+            posting = self.postings[token]
+            del posting[key]
+            if not posting:
+                del self.postings[token]
+                del self.tokens[bisect_left(self.tokens, token)]
+        if self.docs.pop(key, None) is not None:
+            self._keys_by_kind[key[0]].discard(key)
+            self._changed()
+
+    def _changed(self):
+        self._title_order = None
+        self._results.clear()
+
+    def _order(self) -> dict:
+        # Position of every document by title, the tie-break between equal scores
+        if self._title_order is None:
+            ordered = sorted(self.docs, key=lambda key: (self.docs[key]["title"], key))
+            self._title_order = {key: i for i, key in enumerate(ordered)}
+        return self._title_order
+
+    def sync(self, snapshot: CatalogSnapshot):
+        current = {("session", doc["id"]): doc for doc in snapshot.sessions}
+        current.update({("program", doc["id"]): doc for doc in snapshot.programs})
+        for key in [key for key in self.docs if key not in current]:
+            self.remove(key)
+        for key, doc in current.items():
+            if self.docs.get(key) != doc:
+                self.add(key, doc)
+        self._order()
+
+    def _matches(self, term: str) -> dict:
+        # Terms shorter than min_prefix_length match whole tokens only, and a prefix expands to at
+        # most max_prefix_tokens tokens; either would otherwise pull in much of the vocabulary
+        exact = self.postings.get(term)
+        matches = dict(exact) if exact else {}
+        if len(term) < self.min_prefix_length:
+            return matches
+        start = bisect_left(self.tokens, term)
+        end = min(bisect_left(self.tokens, term + "\uffff"), start + self.max_prefix_tokens)
+        for token in self.tokens[start:end]:
+            if token == term:
+                continue
+            if not matches:
+                matches = {key: weight * 0.5 for key, weight in self.postings[token].items()}
+                continue
+            for key, weight in self.postings[token].items():
+                weight *= 0.5
+                if weight > matches.get(key, 0.0):
+                    matches[key] = weight
+        return matches
+
+    def _rank(self, terms: tuple, kind: Optional[str]) -> List[tuple]:
+        scores = None
+        # Intersect starting from the rarest term so later passes only probe the survivors
+        for matches in sorted((self._matches(term) for term in terms), key=len):
+            if scores is None:
+                scores = matches
+            else:
+                scores = {key: score + matches[key] for key, score in scores.items() if key in matches}
+            if not scores:
+                return []
+        candidates = list(scores.keys() & self._keys_by_kind[kind] if kind else scores)
+        # Vectorised: one Python-level sort key per match was most of the cost on common terms
+        values = np.fromiter(map(scores.__getitem__, candidates), np.float64, len(candidates))
+        ranks = np.fromiter(map(self._order().__getitem__, candidates), np.int64, len(candidates))
+        top = np.lexsort((ranks, -values))[:SEARCH_MAX_LIMIT]
+        return [(candidates[i][0], self.docs[candidates[i]], float(values[i])) for i in top]
+
+    def search(self, query: str, limit: int = 20, kind: Optional[str] = None) -> List[tuple]:
+        terms = tuple(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        ranked = self._results.get((terms, kind))
+        if ranked is None:
+            ranked = self._rank(terms, kind)
+            self._results.set((terms, kind), ranked)
+        return ranked[:limit]
+
+search_index = SearchIndex(SEARCH_MIN_PREFIX_LENGTH, SEARCH_MAX_PREFIX_TOKENS, SEARCH_CACHE_SIZE)
+catalog_cache.subscribe(search_index.sync)
+
+async def get_catalog_version() -> int:
+    meta = await db.catalog_meta.find_one({"_id": "catalog"})
+    return meta["version"] if meta else 0
+
+async def bump_catalog_version() -> int:
+    meta = await db.catalog_meta.find_one_and_update(
+        {"_id": "catalog"},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    catalog_cache.invalidate()
+    return meta["version"]
+
+def encode_cursor(value: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"after": value}).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        after = json.loads(base64.urlsafe_b64decode(padded))["after"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(after, str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return after
+
+def ndjson_line(doc: dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(doc, default=str, option=orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(doc, default=str) + "\n"
+
+async def stream_ndjson(docs):
+    for doc in docs:
+        yield ndjson_line(doc)
+
+async def stream_mongo_ndjson(mongo_cursor, convert=None):
+    async for doc in mongo_cursor:
+        doc.pop("_id", None)
+        yield ndjson_line(convert(doc) if convert else doc)
+
+def catalog_response(response: Response, content):
+    if FAST_JSON_RESPONSES:
+        return ORJSONResponse(content, headers=dict(response.headers))
+    return content
+
+def paginate_catalog(response: Response, items: List[dict], cursor: Optional[str], limit: Optional[int], format: str):
+    start = bisect_right(items, decode_cursor(cursor), key=lambda doc: doc["id"]) if cursor else 0
+    if format == "ndjson" and limit is None:
+        end = len(items)
+    else:
+        end = start + (limit or DEFAULT_PAGE_SIZE)
+    page = items[start:end]
+    if end < len(items) and page:
+        response.headers["X-Next-Cursor"] = encode_cursor(page[-1]["id"])
+    if format == "ndjson":
+        return StreamingResponse(stream_ndjson(page), media_type=NDJSON_MEDIA_TYPE, headers=dict(response.headers))
+    return catalog_response(response, page)
+
+def select_catalog_ids(response: Response, items_by_id: dict, ids: str, format: str):
+    requested = list(dict.fromkeys(part for part in (raw.strip() for raw in ids.split(",")) if part))
+    if len(requested) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PAGE_SIZE} ids per request")
+    found = [items_by_id[item_id] for item_id in requested if item_id in items_by_id]
+    missing = [item_id for item_id in requested if item_id not in items_by_id]
+    if missing:
+        # Proxies reject large headers (often 4-8 KB in total), so only the first ids that fit are listed;
+        # X-Missing-Count always carries the full number
+        response.headers["X-Missing-Count"] = str(len(missing))
+        listed, size = [], -1
+        for item_id in missing:
+            size += len(item_id.encode()) + 1
+            if size > MISSING_IDS_HEADER_MAX_BYTES:
+                break
+            listed.append(item_id)
+        if listed:
+            response.headers["X-Missing-Ids"] = ",".join(listed)
+    if format == "ndjson":
+        return StreamingResponse(stream_ndjson(found), media_type=NDJSON_MEDIA_TYPE, headers=dict(response.headers))
+    return catalog_response(response, found)
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+async def conditional_catalog(request: Request, response: Response) -> CatalogSnapshot:
+    catalog = await catalog_cache.get()
+    representation = f"{request.url.path}?{request.url.query}".encode()
+    etag = f'"catalog-{catalog.version}-{zlib.crc32(representation):08x}"'
+    headers = {"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return catalog
+
+class MemoryBucketStore:
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, key: str, per_second: float, burst: float) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * per_second)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / per_second
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+class MongoBucketStore:
+    async def take(self, key: str, per_second: float, burst: float) -> float:
+        now = time.time()
+        refilled = {"$min": [burst, {"$add": [
+            {"$ifNull": ["$tokens", burst]},
+            {"$multiply": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, per_second]},
+        ]}]}
+        bucket = await db.rate_limits.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": now}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=burst / per_second),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return 0.0 if bucket["allowed"] else (1 - bucket["tokens"]) / per_second
+
+class AuthRateLimiter:
+    def __init__(self, store):
+        self.store = store
+        self.rejected = 0
+
+    async def check(self, request: Request, email: str):
+        if self.store is None:
+            return
+        retry_after = max(
+            await self.store.take(f"ip:{client_ip(request)}", AUTH_RATE_LIMIT_IP_PER_MINUTE / 60, AUTH_RATE_LIMIT_IP_BURST),
+            await self.store.take(f"email:{email.lower()}", AUTH_RATE_LIMIT_EMAIL_PER_MINUTE / 60, AUTH_RATE_LIMIT_EMAIL_BURST),
+        )
+        if retry_after > 0:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many attempts, please try again later",
+                headers={"Retry-After": str(int(retry_after) + 1)},
+            )
+
+def client_ip(request: Request) -> str:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+auth_rate_limiter = AuthRateLimiter({
+    "memory": MemoryBucketStore(AUTH_RATE_LIMIT_MAX_KEYS),
+    "mongo": MongoBucketStore(),
+}.get(AUTH_RATE_LIMIT_BACKEND))
+
+def create_access_token(data: dict, expires_minutes: int = ACCESS_TOKEN_EXPIRE_MINUTES) -> str:
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    expire = datetime.now(timezone.utc) + timedelta(minutes=expires_minutes)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
+def create_claims_access_token(user: dict) -> str:
+    claims = {field: user.get(field) for field in CLAIMS_FIELDS}
+    return create_access_token(
+        {"sub": user["id"], "typ": "access", "ver": CLAIMS_VERSION, "claims": claims},
+        CLAIMS_ACCESS_TOKEN_EXPIRE_MINUTES,
+    )
+
+def create_refresh_token(user_id: str) -> str:
+    return create_access_token({"sub": user_id, "typ": "refresh"}, REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60)
+
+def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    payload = decode_token(credentials.credentials)
+    if payload.get("typ") == "refresh":
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("ver") == CLAIMS_VERSION and isinstance(payload.get("claims"), dict):
+        return {"id": payload["sub"], "principal": True, **payload["claims"]}
+    user = await load_user(payload["sub"])
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user
+
+async def require_admin(x_admin_key: Optional[str] = Header(None)):
+    if not ADMIN_API_KEY or not x_admin_key or not hmac.compare_digest(x_admin_key, ADMIN_API_KEY):
+        raise HTTPException(status_code=403, detail="Admin access required")
 
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -79,8 +1112,24 @@ class UserLogin(BaseModel):
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
     user: User
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+def issue_tokens(user: dict) -> TokenResponse:
+    user_response = User(**{k: v for k, v in user.items() if k != "password"})
+    if not CLAIMS_TOKENS_ENABLED:
+        return TokenResponse(access_token=create_access_token({"sub": user["id"]}), user=user_response)
+    return TokenResponse(
+        access_token=create_claims_access_token(user),
+        refresh_token=create_refresh_token(user["id"]),
+        expires_in=CLAIMS_ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        user=user_response,
+    )
+
 class Trainer(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -102,6 +1151,10 @@ class Session(BaseModel):
     image: str
     video_url: Optional[str] = None
 
+class ProgramDay(BaseModel):
+    day: int = Field(..., ge=1)
+    session_id: str
+
 class Program(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -113,6 +1166,33 @@ class Program(BaseModel):
     end_date: Optional[str] = None
     category: str
     sessions_count: int
+    schedule: List[ProgramDay] = []
+
+class ProgramSession(Session):
+    day: int
+
+class ProgramDetail(Program):
+    sessions: List[ProgramSession]
+    trainers: List[Trainer]
+
+class SearchResult(BaseModel):
+    type: str
+    id: str
+    title: str
+    category: str
+    image: str
+    trainer_name: Optional[str] = None
+    score: float
+
+class Recommendation(BaseModel):
+    type: str
+    id: str
+    title: str
+    category: str
+    image: str
+    trainer_name: Optional[str] = None
+    duration: Optional[int] = None
+    score: float
 
 class UserProgress(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -123,100 +1203,1228 @@ class UserProgress(BaseModel):
     completed: bool = False
     completed_at: Optional[str] = None
     progress_percentage: int = 0
+    practice_count: int = 0
 
 @api_router.post("/auth/signup", response_model=TokenResponse)
-async def signup(user_input: UserCreate):
+async def signup(user_input: UserCreate, request: Request):
+    await auth_rate_limiter.check(request, user_input.email)
     existing_user = await db.users.find_one({"email": user_input.email}, {"_id": 0})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = hash_password(user_input.password)
+    hashed_password = await password_hasher.hash(user_input.password)
     user = User(email=user_input.email, name=user_input.name)
     user_dict = user.model_dump()
     user_dict["password"] = hashed_password
     
-    await db.users.insert_one(user_dict)
+    try:
+        await db.users.insert_one(user_to_storage(user_dict))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     
-    access_token = create_access_token({"sub": user.id})
-    user_response = User(**{k: v for k, v in user_dict.items() if k != "password"})
-    return TokenResponse(access_token=access_token, user=user_response)
+    return issue_tokens(user_dict)
 
 @api_router.post("/auth/login", response_model=TokenResponse)
-async def login(user_input: UserLogin):
-    user = await db.users.find_one({"email": user_input.email}, {"_id": 0})
-    if not user or not verify_password(user_input.password, user["password"]):
+async def login(user_input: UserLogin, request: Request):
+    await auth_rate_limiter.check(request, user_input.email)
+    user = user_from_storage(await db.users.find_one({"email": user_input.email}))
+    if not user or not await password_hasher.verify(user_input.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    access_token = create_access_token({"sub": user["id"]})
-    user_response = User(**{k: v for k, v in user.items() if k != "password"})
-    return TokenResponse(access_token=access_token, user=user_response)
+    return issue_tokens(user)
+
+@api_router.post("/auth/refresh", response_model=TokenResponse)
+async def refresh_tokens(refresh_input: RefreshRequest):
+    if not CLAIMS_TOKENS_ENABLED:
+        raise HTTPException(status_code=404, detail="Token refresh is not enabled")
+    payload = decode_token(refresh_input.refresh_token)
+    if payload.get("typ") != "refresh":
+        raise HTTPException(status_code=401, detail="Invalid token")
+    user = await load_user(payload["sub"])
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return issue_tokens(user)
 
 @api_router.get("/auth/me", response_model=User)
 async def get_me(current_user: dict = Depends(get_current_user)):
+    if current_user.get("principal"):
+        current_user = await load_user(current_user["id"])
+        if current_user is None:
+            raise HTTPException(status_code=401, detail="User not found")
     return User(**current_user)
 
 @api_router.get("/trainers", response_model=List[Trainer])
-async def get_trainers():
-    trainers = await db.trainers.find({}, {"_id": 0}).to_list(100)
-    return trainers
+async def get_trainers(
+    response: Response,
+    ids: Optional[str] = Query(None, description="Comma-separated ids; returned in this order, other filters are ignored"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    catalog: CatalogSnapshot = Depends(conditional_catalog),
+):
+    if ids is not None:
+        return select_catalog_ids(response, catalog.trainers_by_id, ids, format)
+    return paginate_catalog(response, catalog.trainers, cursor, limit, format)
 
 @api_router.get("/sessions", response_model=List[Session])
-async def get_sessions(category: Optional[str] = None):
-    query = {"category": category} if category else {}
-    sessions = await db.sessions.find(query, {"_id": 0}).to_list(100)
-    return sessions
+async def get_sessions(
+    response: Response,
+    category: Optional[str] = None,
+    ids: Optional[str] = Query(None, description="Comma-separated ids; returned in this order, other filters are ignored"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    catalog: CatalogSnapshot = Depends(conditional_catalog),
+):
+    if ids is not None:
+        return select_catalog_ids(response, catalog.sessions_by_id, ids, format)
+    sessions = catalog.sessions_by_category.get(category, []) if category else catalog.sessions
+    return paginate_catalog(response, sessions, cursor, limit, format)
 
 @api_router.get("/sessions/{session_id}", response_model=Session)
-async def get_session(session_id: str):
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+async def get_session(session_id: str, response: Response, catalog: CatalogSnapshot = Depends(conditional_catalog)):
+    session = catalog.sessions_by_id.get(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    return session
+    return catalog_response(response, session)
 
 @api_router.get("/programs", response_model=List[Program])
-async def get_programs():
-    programs = await db.programs.find({}, {"_id": 0}).to_list(100)
-    return programs
+async def get_programs(
+    response: Response,
+    ids: Optional[str] = Query(None, description="Comma-separated ids; returned in this order, other filters are ignored"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    catalog: CatalogSnapshot = Depends(conditional_catalog),
+):
+    if ids is not None:
+        return select_catalog_ids(response, catalog.programs_by_id, ids, format)
+    return paginate_catalog(response, catalog.programs, cursor, limit, format)
 
 @api_router.get("/programs/{program_id}", response_model=Program)
-async def get_program(program_id: str):
-    program = await db.programs.find_one({"id": program_id}, {"_id": 0})
+async def get_program(program_id: str, response: Response, catalog: CatalogSnapshot = Depends(conditional_catalog)):
+    program = catalog.programs_by_id.get(program_id)
     if not program:
         raise HTTPException(status_code=404, detail="Program not found")
-    return program
+    return catalog_response(response, program)
+
+def program_detail_pipeline(program_id: str) -> List[dict]:
+    return [
+        {"$match": {"id": program_id}},
+        {"$lookup": {"from": "sessions", "localField": "schedule.session_id", "foreignField": "id", "as": "sessions"}},
+        {"$lookup": {"from": "trainers", "localField": "sessions.trainer_id", "foreignField": "id", "as": "trainers"}},
+        {"$project": {"_id": 0, "sessions._id": 0, "trainers._id": 0}},
+    ]
+
+async def load_program_detail(program_id: str) -> Optional[dict]:
+    docs = await db.programs.aggregate(program_detail_pipeline(program_id)).to_list(1)
+    if not docs:
+        return None
+    program = docs[0]
+    sessions_by_id = {session["id"]: session for session in program["sessions"]}
+    program["sessions"] = [
+        {**sessions_by_id[entry["session_id"]], "day": entry["day"]}
+        for entry in sorted(program.get("schedule") or [], key=lambda entry: entry["day"])
+        if entry["session_id"] in sessions_by_id
+    ]
+    return ProgramDetail.model_validate(program).model_dump()
+
+# Keyed by catalog version as well as id: a session or trainer edit changes the composed page too
+program_detail_cache = LRUCache(True, PROGRAM_DETAIL_CACHE_SIZE)
+program_detail_flight = SingleFlight()
+catalog_cache.subscribe(lambda snapshot: program_detail_cache.clear())
+
+@api_router.get("/programs/{program_id}/full", response_model=ProgramDetail)
+async def get_program_full(program_id: str, response: Response, catalog: CatalogSnapshot = Depends(conditional_catalog)):
+    key = (program_id, catalog.version)
+    detail = program_detail_cache.get(key)
+    if detail is None:
+        detail = await program_detail_flight.do(key, lambda: load_program_detail(program_id))
+        if detail is None:
+            raise HTTPException(status_code=404, detail="Program not found")
+        program_detail_cache.set(key, detail)
+    return catalog_response(response, detail)
+
+@api_router.get("/search", response_model=List[SearchResult])
+async def search_catalog(
+    q: str = Query(..., min_length=1, max_length=200),
+    type: Optional[str] = Query(None, pattern="^(session|program)$"),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT),
+):
+    await catalog_cache.get()
+    return [
+        SearchResult(type=kind, score=round(score, 3), **{field: doc.get(field) for field in ("id", "title", "category", "image", "trainer_name")})
+        for kind, doc, score in search_index.search(q, limit, type)
+    ]
 
 @api_router.get("/progress", response_model=List[UserProgress])
-async def get_user_progress(current_user: dict = Depends(get_current_user)):
-    progress = await db.progress.find({"user_id": current_user["id"]}, {"_id": 0}).to_list(100)
+async def get_user_progress(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    current_user: dict = Depends(get_current_user),
+):
+    query = {"user_id": current_user["id"]}
+    if cursor:
+        try:
+            query["_id"] = {"$gt": ObjectId(decode_cursor(cursor))}
+        except (InvalidId, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    mongo_cursor = db.progress.find(query, {"practice_days": 0, "last_practice": 0}).sort("_id", ASCENDING)
+    
+    if format == "ndjson":
+        if limit is not None:
+            mongo_cursor = mongo_cursor.limit(limit)
+        return StreamingResponse(stream_mongo_ndjson(mongo_cursor.batch_size(500), progress_from_storage), media_type=NDJSON_MEDIA_TYPE)
+    
+    page_size = limit or DEFAULT_PAGE_SIZE
+    progress = await mongo_cursor.limit(page_size + 1).to_list(page_size + 1)
+    if len(progress) > page_size:
+        progress = progress[:page_size]
+        response.headers["X-Next-Cursor"] = encode_cursor(str(progress[-1]["_id"]))
+    for doc in progress:
+        doc.pop("_id", None)
+        progress_from_storage(doc)
     return progress
 
 class ProgressUpdate(BaseModel):
     session_id: Optional[str] = None
     program_id: Optional[str] = None
     completed: bool = False
-    progress_percentage: int = 0
+    progress_percentage: int = Field(0, ge=0, le=100)
+
+    @model_validator(mode="after")
+    def one_item(self):
+        # session_id and program_id are both part of the upsert key, so a row names exactly one item
+        if (self.session_id is None) == (self.program_id is None):
+            raise ValueError("Exactly one of session_id and program_id is required")
+        return self
+
+class ProgressBatch(BaseModel):
+    updates: List[ProgressUpdate] = Field(..., max_length=PROGRESS_BATCH_MAX_ITEMS)
+
+class ProgressBatchResult(BaseModel):
+    received: int
+    coalesced: int
+    buffered: bool
+
+class ProgressSummary(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    user_id: str
+    completed_sessions: int = 0
+    completed_programs: int = 0
+    minutes_practiced: int = 0
+    current_streak: int = 0
+    longest_streak: int = 0
+    last_practice_date: Optional[str] = None
+
+def progress_key(user_id: str, session_id: Optional[str], program_id: Optional[str]) -> dict:
+    return {"user_id": user_id, "session_id": session_id, "program_id": program_id}
+
+def progress_upsert_pipeline(progress_input: ProgressUpdate, now, practiced: List = (), write_id: Optional[str] = None) -> List[dict]:
+    # practiced holds the time of every completed report merged into this update. Practice counts
+    # once per item and day, so repeated end-of-video reports and client retries add nothing; the
+    # days this write added are left in last_practice, tagged with write_id, for the caller to read.
+    pipeline = []
+    if practiced:
+        # Rows completed before practice days were kept count their completion day
+        known_days = {"$ifNull": ["$practice_days", {"$cond": [
+            {"$ifNull": ["$completed_at", False]},
+            [{"$substrCP": [{"$toString": "$completed_at"}, 0, 10]}],
+            [],
+        ]}]}
+        days = sorted({storage_day(practiced_at) for practiced_at in practiced})
+        pipeline.append({"$set": {"last_practice": {"write": write_id, "days": {"$filter": {
+            "input": days, "as": "day", "cond": {"$eq": [{"$in": ["$$day", known_days]}, False]},
+        }}}}})
+        pipeline.append({"$set": {"practice_days": {"$setUnion": [known_days, days]}}})
+    fields = {
+        "id": {"$ifNull": ["$id", to_storage_id(str(uuid.uuid4()))]},
+        "progress_percentage": {"$max": [{"$ifNull": ["$progress_percentage", 0]}, progress_input.progress_percentage]},
+        "completed": {"$or": [{"$ifNull": ["$completed", False]}, progress_input.completed]},
+        "completed_at": {"$ifNull": ["$completed_at", now if progress_input.completed else None]},
+        # Always a BSON date taken at write time, so incremental exports can range over it
+        "updated_at": _naive_utc(datetime.now(timezone.utc)),
+    }
+    if practiced:
+        fields["practice_count"] = {"$size": "$practice_days"}
+    pipeline.append({"$set": fields})
+    return pipeline
+
+def new_practice_days(progress: dict, write_id: str) -> set:
+    last_practice = progress.get("last_practice") or {}
+    return set(last_practice.get("days", [])) if last_practice.get("write") == write_id else set()
+
+def practice_event(progress: dict, practiced_at, first_completion: bool) -> dict:
+    return {
+        **progress_key(progress["user_id"], progress.get("session_id"), progress.get("program_id")),
+        "practiced_at": practiced_at,
+        "first_completion": first_completion,
+    }
+
+async def upsert_progress(user_id: str, progress_input: ProgressUpdate) -> dict:
+    key = progress_key(user_id, progress_input.session_id, progress_input.program_id)
+    now = storage_now()
+    write_id = uuid.uuid4().hex
+    pipeline = progress_upsert_pipeline(progress_input, now, [now] if progress_input.completed else [], write_id)
+    for attempt in range(2):
+        try:
+            progress = await db.progress.find_one_and_update(
+                key,
+                pipeline,
+                projection={"_id": 0, "practice_days": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            break
+        except DuplicateKeyError:
+            if attempt:
+                raise
+    recommendation_engine.invalidate(user_id)
+    if new_practice_days(progress, write_id):
+        await record_practice([practice_event(progress, now, progress["completed_at"] == now)])
+    return progress_from_storage(progress)
+
+async def collapse_progress_duplicates(batch_size: int = 1000) -> dict:
+    pipeline = [
+        {"$sort": {"_id": 1}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "session_id": "$session_id", "program_id": "$program_id"},
+            "keep": {"$first": "$_id"},
+            "doc_ids": {"$push": "$_id"},
+            "progress_percentage": {"$max": "$progress_percentage"},
+            "completed": {"$max": "$completed"},
+            "completed_at": {"$min": "$completed_at"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    groups, removed, operations = 0, 0, []
+    async for group in db.progress.aggregate(pipeline, allowDiskUse=True):
+        duplicates = [doc_id for doc_id in group["doc_ids"] if doc_id != group["keep"]]
+        operations.append(UpdateOne({"_id": group["keep"]}, {"$set": {
+            "progress_percentage": group["progress_percentage"],
+            "completed": group["completed"],
+            "completed_at": group["completed_at"],
+            "updated_at": _naive_utc(datetime.now(timezone.utc)),
+        }}))
+        operations.append(DeleteMany({"_id": {"$in": duplicates}}))
+        groups += 1
+        removed += len(duplicates)
+        if len(operations) >= batch_size:
+            await db.progress.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await db.progress.bulk_write(operations, ordered=False)
+    return {"collapsed_groups": groups, "removed_documents": removed}
+
+async def backfill_progress_updated_at() -> dict:
+    # Rows written before updated_at existed take the creation time from their _id
+    result = await db.progress.update_many(
+        {"updated_at": {"$exists": False}}, [{"$set": {"updated_at": {"$toDate": "$_id"}}}]
+    )
+    return {"backfilled_updated_at": result.modified_count}
+
+def _first_per_day(times: List) -> List:
+    days, first = set(), []
+    for practiced_at in times:
+        if storage_day(practiced_at) not in days:
+            days.add(storage_day(practiced_at))
+            first.append(practiced_at)
+    return first
+
+def merge_progress_update(entries: dict, user_id: str, progress_input: ProgressUpdate, now, practiced: List = None):
+    # Entries map (user_id, session_id, program_id) to (update, completed_at, practiced); practiced
+    # keeps the first completed report of each day, the only one that can count as practice
+    key = (user_id, progress_input.session_id, progress_input.program_id)
+    if practiced is None:
+        practiced = [now] if progress_input.completed else []
+    pending = entries.get(key)
+    if pending is None:
+        entries[key] = (progress_input.model_copy(), now if progress_input.completed else None, _first_per_day(practiced))
+        return
+    merged, completed_at, merged_practiced = pending
+    merged.progress_percentage = max(merged.progress_percentage, progress_input.progress_percentage)
+    if progress_input.completed and not merged.completed:
+        merged.completed = True
+        completed_at = now
+    entries[key] = (merged, completed_at, _first_per_day(merged_practiced + list(practiced)))
+
+class PartialProgressWrite(Exception):
+    # Some upserts of an unordered bulk write failed; every other one was applied
+    def __init__(self, events: List[dict], failed: dict):
+        super().__init__(f"{len(failed)} progress upserts failed")
+        self.events = events
+        self.failed = failed
+
+async def write_progress_updates(entries: dict) -> List[dict]:
+    # Returns the practice events of this write; the caller records them, exactly once. When only
+    # some upserts fail, PartialProgressWrite carries the events of the applied ones and the
+    # entries to retry.
+    write_ids = {key: uuid.uuid4().hex for key in entries}
+    operations = [
+        UpdateOne(
+            progress_key(*key),
+            progress_upsert_pipeline(progress_input, completed_at, practiced, write_ids[key]),
+            upsert=True,
+        )
+        for key, (progress_input, completed_at, practiced) in entries.items()
+    ]
+    if not operations:
+        return []
+    failed = {}
+    try:
+        await db.progress.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        keys = list(entries)
+        failed = {keys[error["index"]]: entries[keys[error["index"]]] for error in e.details["writeErrors"]}
+        entries = {key: entry for key, entry in entries.items() if key not in failed}
+    for user_id in {user_id for user_id, _, _ in entries}:
+        recommendation_engine.invalidate(user_id)
+    events = await _practice_events(entries, write_ids)
+    if failed:
+        raise PartialProgressWrite(events, failed)
+    return events
+
+async def _practice_events(entries: dict, write_ids: dict) -> List[dict]:
+    practiced_keys = [progress_key(*key) for key, (_, _, practiced) in entries.items() if practiced]
+    if not practiced_keys:
+        return []
+    rows = {
+        (doc["user_id"], doc.get("session_id"), doc.get("program_id")): doc
+        async for doc in db.progress.find(
+            {"$or": practiced_keys},
+            {"_id": 0, "user_id": 1, "session_id": 1, "program_id": 1, "completed_at": 1, "last_practice": 1},
+        )
+    }
+    events = []
+    for key, (_, completed_at, practiced) in entries.items():
+        row = rows.get(key, {})
+        days = new_practice_days(row, write_ids[key])
+        # A row was completed by this write when it still carries the completion time the write set
+        first = completed_at is not None and row.get("completed_at") == completed_at
+        for practiced_at in practiced:
+            if storage_day(practiced_at) in days:
+                events.append(practice_event(progress_key(*key), practiced_at, first and practiced_at == completed_at))
+    return events
+
+def _previous_day(day: str) -> str:
+    return (datetime.fromisoformat(day) - timedelta(days=1)).date().isoformat()
+
+def _rollup_practice_pipeline(day: str, sessions: int, programs: int, minutes: int) -> List[dict]:
+    last_day = {"$ifNull": ["$last_practice_date", ""]}
+    current = {"$ifNull": ["$current_streak", 0]}
+    streak = {"$switch": {
+        "branches": [
+            {"case": {"$eq": [last_day, day]}, "then": current},
+            {"case": {"$eq": [last_day, _previous_day(day)]}, "then": {"$add": [current, 1]}},
+            {"case": {"$gt": [last_day, day]}, "then": current},
+        ],
+        "default": 1,
+    }}
+    return [
+        {"$set": {
+            "completed_sessions": {"$add": [{"$ifNull": ["$completed_sessions", 0]}, sessions]},
+            "completed_programs": {"$add": [{"$ifNull": ["$completed_programs", 0]}, programs]},
+            "minutes_practiced": {"$add": [{"$ifNull": ["$minutes_practiced", 0]}, minutes]},
+            "current_streak": streak,
+        }},
+        {"$set": {
+            "longest_streak": {"$max": [{"$ifNull": ["$longest_streak", 0]}, "$current_streak"]},
+            "last_practice_date": {"$max": [last_day, day]},
+        }},
+    ]
+
+async def record_practice(events: List[dict]):
+    # Every practice event (at most one per user, item and day) adds its minutes and practice day; only
+    # a first completion counts towards completed sessions and programs and the co-completion signal
+    if not events:
+        return
+    catalog = await catalog_cache.get()
+    operations, practiced = [], []
+    for event in sorted(events, key=lambda event: from_storage_time(event["practiced_at"])):
+        session = catalog.sessions_by_id.get(event["session_id"]) if event["session_id"] else None
+        day = storage_day(event["practiced_at"])
+        minutes = session["duration"] if session else 0
+        operations.append(UpdateOne(
+            {"user_id": event["user_id"]},
+            _rollup_practice_pipeline(
+                day,
+                sessions=1 if event["first_completion"] and event["session_id"] else 0,
+                programs=1 if event["first_completion"] and event["program_id"] else 0,
+                minutes=minutes,
+            ),
+            upsert=True,
+        ))
+        practiced.append((event["user_id"], day, minutes))
+    await db.progress_rollups.bulk_write(operations, ordered=True)
+    recommendation_engine.record_completions([event for event in events if event["first_completion"]])
+    leaderboard.record(practiced)
+
+def _streaks(days: List[str]) -> tuple:
+    current, longest, previous = 0, 0, None
+    for day in sorted(set(days)):
+        current = current + 1 if previous is not None and _previous_day(day) == previous else 1
+        longest = max(longest, current)
+        previous = day
+    return current, longest
+
+async def rebuild_progress_rollups(batch_size: int = 1000) -> dict:
+    catalog = await catalog_cache.get()
+    pipeline = [
+        {"$match": {"completed": True, "completed_at": {"$ne": None}}},
+        {"$group": {
+            "_id": "$user_id",
+            # One practice per day the session was practised on, as upserts count it
+            "sessions": {"$push": {
+                "session_id": "$session_id",
+                "practice_count": {"$max": [1, {"$size": {"$ifNull": ["$practice_days", []]}}]},
+            }},
+            "programs": {"$sum": {"$cond": [{"$ifNull": ["$program_id", False]}, 1, 0]}},
+            "days": {"$addToSet": {"$cond": [
+                {"$eq": [{"$type": "$completed_at"}, "date"]},
+                {"$dateToString": {"format": "%Y-%m-%d", "date": "$completed_at"}},
+                {"$substrBytes": ["$completed_at", 0, 10]},
+            ]}},
+            "practice_days": {"$push": {"$ifNull": ["$practice_days", []]}},
+        }},
+    ]
+    users, operations = 0, []
+    async for group in db.progress.aggregate(pipeline, allowDiskUse=True):
+        sessions = [session for session in group["sessions"] if session.get("session_id")]
+        days = set(group["days"]).union(*group["practice_days"])
+        current, longest = _streaks(days)
+        rollup = ProgressSummary(
+            user_id=group["_id"],
+            completed_sessions=len(sessions),
+            completed_programs=group["programs"],
+            minutes_practiced=sum(
+                catalog.sessions_by_id[session["session_id"]]["duration"] * session["practice_count"]
+                for session in sessions
+                if session["session_id"] in catalog.sessions_by_id
+            ),
+            current_streak=current,
+            longest_streak=longest,
+            last_practice_date=max(days),
+        )
+        operations.append(UpdateOne({"user_id": rollup.user_id}, {"$set": rollup.model_dump()}, upsert=True))
+        users += 1
+        if len(operations) >= batch_size:
+            await db.progress_rollups.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await db.progress_rollups.bulk_write(operations, ordered=False)
+    return {"rebuilt_users": users}
+
+async def _supports_transactions() -> bool:
+    try:
+        hello = await client.admin.command("hello")
+    except Exception:
+        return False
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+async def _replace_user_document(old_id, stored: dict, transactions: bool):
+    # _id cannot be changed in place, and the email index forbids having both copies at once
+    if transactions:
+        async with await client.start_session() as session:
+            async with session.start_transaction():
+                await db.users.delete_one({"_id": old_id}, session=session)
+                await db.users.insert_one(stored, session=session)
+        return
+    # Without transactions the old document is parked in users_migration_backup first, so a crash
+    # between the delete and the insert leaves a copy that the next run finishes from
+    old = await db.users.find_one({"_id": old_id})
+    if old is None:
+        return
+    await db.users_migration_backup.replace_one({"_id": old_id}, old, upsert=True)
+    await db.users.delete_one({"_id": old_id})
+    await _finish_user_replacement(old, stored)
+
+async def _finish_user_replacement(old: dict, stored: dict):
+    try:
+        await db.users.insert_one(stored)
+    except DuplicateKeyError:
+        if await db.users.find_one({"_id": stored["_id"], "email": stored["email"]}, {"_id": 1}) is None:
+            await db.users.insert_one(old)
+            await db.users_migration_backup.delete_one({"_id": old["_id"]})
+            raise
+    await db.users_migration_backup.delete_one({"_id": old["_id"]})
+
+async def _resume_user_replacements(report: dict):
+    async for old in db.users_migration_backup.find({}):
+        if await db.users.find_one({"_id": old["_id"]}, {"_id": 1}) is not None:
+            # Interrupted before the delete; the main loop migrates it again
+            await db.users_migration_backup.delete_one({"_id": old["_id"]})
+            continue
+        user = user_from_storage(old)
+        try:
+            await _finish_user_replacement(old, user_to_storage(user))
+        except DuplicateKeyError:
+            report["users_failed"].append(user["id"])
+            continue
+        report["users_resumed"] += 1
+
+async def migrate_compact_storage(batch_size: int = 1000) -> dict:
+    if not COMPACT_STORAGE:
+        raise RuntimeError("Set COMPACT_STORAGE=true before migrating to compact storage")
+    report = {"progress_migrated": 0, "users_migrated": 0, "users_resumed": 0, "users_failed": []}
+    await _resume_user_replacements(report)
+
+    # Progress keeps its ObjectId _id (cursor pagination and export checkpoints depend on it),
+    # so it is rewritten in place and stays fully readable throughout
+    legacy_progress = {"$or": [{"id": {"$type": "string"}}, {"completed_at": {"$type": "string"}}]}
+    operations = []
+    async for doc in db.progress.find(legacy_progress, {"id": 1, "completed_at": 1}).batch_size(batch_size):
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": progress_to_storage(progress_from_storage(doc))}))
+        if len(operations) >= batch_size:
+            report["progress_migrated"] += (await db.progress.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    if operations:
+        report["progress_migrated"] += (await db.progress.bulk_write(operations, ordered=False)).modified_count
+
+    transactions = await _supports_transactions()
+    async for doc in db.users.find({"id": {"$exists": True}}).batch_size(batch_size):
+        user = user_from_storage(doc)
+        try:
+            await _replace_user_document(doc["_id"], user_to_storage(user), transactions)
+        except DuplicateKeyError:
+            report["users_failed"].append(user["id"])
+            continue
+        user_loader.forget(user["id"])
+        user_cache.invalidate(user["id"])
+        report["users_migrated"] += 1
+    report["transactions"] = transactions
+    return report
+
+class ProgressWriteBuffer:
+    def __init__(self, flush_seconds: float, max_items: int, reject_factor: int):
+        self.flush_seconds = flush_seconds
+        self.max_items = max_items
+        self.reject_after = max_items * reject_factor
+        self.added = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.rejected = 0
+        self.completion_failures = 0
+        self._entries = {}
+        self._task = None
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        self._stopping = asyncio.Event()
+
+    def add(self, entries: dict):
+        # Failed flushes requeue their entries, so while Mongo is down the buffer only grows
+        if len(self._entries) + len(entries) > self.reject_after:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Progress updates are backing up, retry later",
+                headers={"Retry-After": str(int(self.flush_seconds) + 1)},
+            )
+        self._merge(entries)
+        self.added += len(entries)
+        if len(self._entries) >= self.max_items and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        async with self._flush_lock:
+            entries, self._entries = self._entries, {}
+            if not entries:
+                return
+            try:
+                events = await write_progress_updates(entries)
+            except PartialProgressWrite as e:
+                # Requeueing the applied upserts as well would drop their practice: on replay the
+                # row already knows the day, so no event would be emitted for it
+                logger.warning("%d of %d progress upserts failed, requeueing them", len(e.failed), len(entries))
+                self._merge(e.failed)
+                entries = {key: entry for key, entry in entries.items() if key not in e.failed}
+                events = e.events
+            except Exception:
+                logger.exception("Progress flush failed, requeueing %d entries", len(entries))
+                self._merge(entries)
+                return
+            self.flushed += len(entries)
+            self.flushes += 1
+            try:
+                await record_practice(events)
+            except Exception:
+                # The progress rows are written; requeueing them would count this practice twice
+                self.completion_failures += 1
+                logger.exception(
+                    "Recording %d practice events failed; `manage.py rebuild-rollups` repairs the rollups", len(events)
+                )
+
+    def _merge(self, entries: dict):
+        for (user_id, _, _), (progress_input, completed_at, practiced) in entries.items():
+            merge_progress_update(self._entries, user_id, progress_input, completed_at, practiced)
+
+    async def _run(self):
+        # Stopped through _stopping rather than cancel(): a cancelled flush would lose the entries
+        # it had already taken out of the buffer
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+progress_buffer = ProgressWriteBuffer(PROGRESS_FLUSH_SECONDS, PROGRESS_BUFFER_MAX_ITEMS, PROGRESS_BUFFER_REJECT_FACTOR)
 
 @api_router.post("/progress", response_model=UserProgress)
 async def update_progress(progress_input: ProgressUpdate, current_user: dict = Depends(get_current_user)):
-    progress = UserProgress(
-        user_id=current_user["id"],
-        session_id=progress_input.session_id,
-        program_id=progress_input.program_id,
-        completed=progress_input.completed,
-        completed_at=datetime.now(timezone.utc).isoformat() if progress_input.completed else None,
-        progress_percentage=progress_input.progress_percentage
-    )
+    return await upsert_progress(current_user["id"], progress_input)
+
+@api_router.get("/progress/summary", response_model=ProgressSummary)
+async def get_progress_summary(current_user: dict = Depends(get_current_user)):
+    rollup = await db.progress_rollups.find_one({"user_id": current_user["id"]}, {"_id": 0})
+    summary = ProgressSummary(**(rollup or {"user_id": current_user["id"]}))
+    today = datetime.now(timezone.utc).date().isoformat()
+    if summary.last_practice_date not in (today, _previous_day(today)):
+        summary.current_streak = 0
+    return summary
+
+@api_router.post("/progress/batch", response_model=ProgressBatchResult)
+async def update_progress_batch(batch: ProgressBatch, current_user: dict = Depends(get_current_user)):
+    entries = {}
+    now = storage_now()
+    for progress_input in batch.updates:
+        merge_progress_update(entries, current_user["id"], progress_input, now)
     
-    progress_dict = progress.model_dump()
-    await db.progress.insert_one(progress_dict)
-    return progress
+    if PROGRESS_WRITE_BEHIND:
+        progress_buffer.add(entries)
+    else:
+        try:
+            events = await write_progress_updates(entries)
+        except PartialProgressWrite as e:
+            await record_practice(e.events)
+            raise HTTPException(status_code=503, detail=f"{len(e.failed)} progress updates were not saved, retry them")
+        await record_practice(events)
+    return ProgressBatchResult(received=len(batch.updates), coalesced=len(entries), buffered=PROGRESS_WRITE_BEHIND)
+
+PROGRESS_EXPORT_FIELDS = (
+    "_id", "id", "user_id", "session_id", "program_id", "completed", "completed_at", "progress_percentage", "practice_count",
+    "updated_at",
+)
+EXPORT_MEDIA_TYPES = {"ndjson": NDJSON_MEDIA_TYPE, "csv": "text/csv"}
+
+def export_checkpoint(row: dict) -> str:
+    # The last exported row's updated_at and _id, exactly as they appear in the output
+    return f"{row['updated_at']},{row['_id']}"
+
+def parse_export_checkpoint(checkpoint: str) -> tuple:
+    updated_at, _, doc_id = checkpoint.partition(",")
+    return _naive_utc(datetime.fromisoformat(updated_at)), ObjectId(doc_id)
+
+def progress_export_query(since: Optional[datetime] = None, until: Optional[datetime] = None, after: Optional[str] = None) -> dict:
+    # Rows are updated in place, so the range and the resume point are on (updated_at, _id), which
+    # the updated_at__id index serves in sort order. Rows changed in the last few seconds are left
+    # for the next run, as a write stamped earlier may still be committing.
+    settled = _naive_utc(datetime.now(timezone.utc) - timedelta(seconds=EXPORT_SETTLE_SECONDS))
+    bounds = {"$lt": min(_naive_utc(until), settled) if until is not None else settled}
+    if since is not None:
+        bounds["$gte"] = _naive_utc(since)
+    query = {"updated_at": bounds}
+    if after:
+        try:
+            updated_at, doc_id = parse_export_checkpoint(after)
+        except (InvalidId, TypeError, ValueError, OverflowError):
+            raise HTTPException(status_code=400, detail="Invalid checkpoint")
+        query = {"$and": [query, {"$or": [
+            {"updated_at": {"$gt": updated_at}},
+            {"updated_at": updated_at, "_id": {"$gt": doc_id}},
+        ]}]}
+    return query
+
+def encode_export_rows(rows: List[dict], format: str) -> bytes:
+    if format == "csv":
+        buffer = io.StringIO()
+        csv.DictWriter(buffer, PROGRESS_EXPORT_FIELDS, extrasaction="ignore", lineterminator="\n").writerows(rows)
+        return buffer.getvalue().encode()
+    lines = [ndjson_line(row) for row in rows]
+    return b"".join(lines) if orjson is not None else "".join(lines).encode()
+
+async def export_progress(query: dict, format: str, batch_size: int = EXPORT_BATCH_SIZE, header: bool = True):
+    # Yields (chunk, checkpoint) pairs; at most one batch of rows is held in memory at a time
+    if format == "csv" and header:
+        yield (",".join(PROGRESS_EXPORT_FIELDS) + "\n").encode(), None
+    mongo_cursor = db.progress.find(query, {"practice_days": 0, "last_practice": 0}).sort(
+        [("updated_at", ASCENDING), ("_id", ASCENDING)]
+    )
+    rows = []
+    async for doc in mongo_cursor.batch_size(batch_size):
+        doc["_id"] = str(doc["_id"])
+        doc["updated_at"] = from_storage_time(doc["updated_at"])
+        rows.append(progress_from_storage(doc))
+        if len(rows) >= batch_size:
+            yield encode_export_rows(rows, format), export_checkpoint(rows[-1])
+            rows = []
+    if rows:
+        yield encode_export_rows(rows, format), export_checkpoint(rows[-1])
+
+async def stream_export(chunks):
+    async for chunk, _ in chunks:
+        yield chunk
+
+@api_router.get("/admin/progress/export", dependencies=[Depends(require_admin)])
+async def export_progress_data(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = Query(None, description="Resume after the last row received, given as '<updated_at>,<_id>'"),
+):
+    query = progress_export_query(since, until, after)
+    return StreamingResponse(
+        stream_export(export_progress(query, format)),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="progress.{format}"'},
+    )
+
+def _item_key(progress: dict) -> tuple:
+    if progress.get("session_id"):
+        return ("session", progress["session_id"])
+    return ("program", progress.get("program_id"))
+
+def _csr(rows: np.ndarray, columns: np.ndarray, size: int) -> tuple:
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return indptr, columns[order]
+
+def _gather(indptr: np.ndarray, indices: np.ndarray, rows: np.ndarray, weights: np.ndarray, limit: int) -> tuple:
+    # Concatenates the CSR rows in one pass. Rows longer than limit are sampled at an even stride
+    # and their weight scaled by the stride, so hugely popular items cost at most limit entries.
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    taken = np.minimum(lengths, limit)
+    steps = lengths / np.maximum(taken, 1)
+    within = np.arange(int(taken.sum())) - np.repeat(np.cumsum(taken) - taken, taken)
+    positions = np.repeat(starts, taken) + (within * np.repeat(steps, taken)).astype(np.int64)
+    return indices[positions], np.repeat(weights * steps, taken)
+
+class RecommendationModel:
+    # Immutable once built apart from completion_counts. Item features are one category plus (for
+    # sessions) one trainer, so content similarity is computed from those indexes instead of a dense
+    # matrix; co-completion uses exact item->users and user->items CSR arrays.
+    def __init__(self, snapshot: CatalogSnapshot, item_rows: np.ndarray, user_columns: np.ndarray, user_index: dict, neighbours: int):
+        self.neighbours = neighbours
+        items = [("session", doc) for doc in snapshot.sessions] + [("program", doc) for doc in snapshot.programs]
+        self.keys = [(kind, doc["id"]) for kind, doc in items]
+        self.docs = [doc for _, doc in items]
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.user_index = user_index
+        categories = {category: i for i, category in enumerate(sorted({doc["category"] for doc in self.docs}))}
+        trainers = {trainer_id: i for i, trainer_id in enumerate(sorted({doc["trainer_id"] for doc in snapshot.sessions}))}
+        self.category_count, self.trainer_count = len(categories), len(trainers)
+        self.categories = np.array([categories[doc["category"]] for doc in self.docs], dtype=np.intp)
+        # Programs point at a spare trainer slot that is zeroed before use
+        self.trainers = np.array(
+            [trainers[doc["trainer_id"]] if kind == "session" else len(trainers) for kind, doc in items], dtype=np.intp
+        )
+        self.feature_values = np.where(self.trainers < len(trainers), 1 / np.sqrt(2), 1.0).astype(np.float32)
+        self.durations = np.array(
+            [doc["duration"] if kind == "session" else np.nan for kind, doc in items], dtype=np.float32
+        )
+
+        # Repeat completions of the same item by the same user count once
+        pairs = np.unique(item_rows.astype(np.int64) * max(len(user_index), 1) + user_columns)
+        item_rows, user_columns = pairs // max(len(user_index), 1), pairs % max(len(user_index), 1)
+        self.item_users = _csr(item_rows, user_columns, len(self.keys))
+        self.user_items = _csr(user_columns, item_rows, len(user_index))
+        self.completion_norms = np.sqrt(np.diff(self.item_users[0])).astype(np.float32)
+        self.completion_counts = np.diff(self.item_users[0]).astype(np.float32)
+
+    def record(self, key: tuple):
+        i = self.index.get(key)
+        if i is not None:
+            self.completion_counts[i] += 1.0
+
+    def score(self, user_id: str, history: List[dict]) -> np.ndarray:
+        popularity = np.log1p(self.completion_counts)
+        popularity /= max(float(popularity.max(initial=0.0)), 1.0)
+        seen, weights = [], []
+        for progress in history:
+            i = self.index.get(_item_key(progress))
+            if i is not None:
+                seen.append(i)
+                weights.append(1.0 if progress.get("completed") else 0.25 + 0.5 * progress.get("progress_percentage", 0) / 100)
+        if not seen:
+            return popularity
+
+        seen = np.array(seen, dtype=np.intp)
+        weights = np.array(weights, dtype=np.float32)
+        weighted = weights * self.feature_values[seen]
+        profile_categories = np.bincount(self.categories[seen], weighted, minlength=self.category_count)
+        profile_trainers = np.bincount(self.trainers[seen], weighted, minlength=self.trainer_count + 1)
+        profile_trainers[-1] = 0.0
+        profile_norm = np.sqrt(np.square(profile_categories).sum() + np.square(profile_trainers).sum())
+        content = self.feature_values * (profile_categories[self.categories] + profile_trainers[self.trainers])
+        content /= max(float(profile_norm), 1e-6)
+
+        # Other users who completed what this user has seen, weighted by the user's engagement
+        users, user_weights = _gather(*self.item_users, seen, weights, self.neighbours)
+        user_vector = np.bincount(users, user_weights, minlength=len(self.user_index))
+        own = self.user_index.get(user_id)
+        if own is not None:
+            user_vector[own] = 0.0
+        neighbours = np.flatnonzero(user_vector)
+        co_completion = np.zeros(len(self.keys), dtype=np.float64)
+        if neighbours.size:
+            items, item_weights = _gather(*self.user_items, neighbours, user_vector[neighbours], self.neighbours)
+            co_completion = np.bincount(items, item_weights, minlength=len(self.keys))
+            row_norms = self.completion_norms * float(np.linalg.norm(user_vector[neighbours]))
+            co_completion = np.divide(co_completion, row_norms, out=np.zeros_like(co_completion), where=row_norms > 0)
+
+        seen_durations = self.durations[seen]
+        seen_durations = seen_durations[~np.isnan(seen_durations)]
+        if seen_durations.size:
+            preferred = float(seen_durations.mean())
+            duration = 1.0 - np.minimum(np.abs(self.durations - preferred) / preferred, 1.0)
+            duration = np.where(np.isnan(duration), 0.5, duration)
+        else:
+            duration = np.full(len(self.keys), 0.5, dtype=np.float32)
+
+        scores = 0.45 * content + 0.35 * co_completion + 0.1 * popularity + 0.1 * duration
+        scores[seen[weights >= 1.0]] = -np.inf
+        return scores
+
+def _encode_completions(batch: List[dict], index: dict, user_index: dict, rows: List[int], columns: List[int]):
+    for progress in batch:
+        i = index.get(_item_key(progress))
+        if i is not None:
+            rows.append(i)
+            columns.append(user_index.setdefault(progress["user_id"], len(user_index)))
+
+class RecommendationEngine:
+    # The model is rebuilt by a background task every refresh_seconds or when the catalog changes;
+    # encoding and the CSR build run in worker threads and the finished model replaces the old one
+    # in a single assignment, so requests keep being served from the previous model meanwhile.
+    def __init__(self, neighbours: int, refresh_seconds: float, cache: LRUCache):
+        self.neighbours = neighbours
+        self.refresh_seconds = refresh_seconds
+        self.cache = cache
+        self.model = None
+        self.builds = 0
+        self._snapshot = None
+        self._stale = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def on_catalog(self, snapshot: CatalogSnapshot):
+        self._snapshot = snapshot
+        self._stale.set()
+
+    async def ensure_built(self):
+        # Only the first request after startup waits for a build
+        if self.model is None:
+            async with self._lock:
+                if self.model is None:
+                    await self.build()
+
+    async def build(self):
+        snapshot = self._snapshot or await catalog_cache.get()
+        index = {("session", doc["id"]): i for i, doc in enumerate(snapshot.sessions)}
+        index.update({("program", doc["id"]): len(snapshot.sessions) + i for i, doc in enumerate(snapshot.programs)})
+        user_index, rows, columns = {}, [], []
+        completed = db.progress.find({"completed": True}, {"_id": 0, "user_id": 1, "session_id": 1, "program_id": 1})
+        while batch := await completed.to_list(5000):
+            await asyncio.to_thread(_encode_completions, batch, index, user_index, rows, columns)
+        self.model = await asyncio.to_thread(
+            RecommendationModel,
+            snapshot,
+            np.array(rows, dtype=np.int64),
+            np.array(columns, dtype=np.int64),
+            user_index,
+            self.neighbours,
+        )
+        self.builds += 1
+        self.cache.clear()
+
+    async def _run(self):
+        while True:
+            self._stale.clear()
+            try:
+                async with self._lock:
+                    await self.build()
+            except Exception:
+                logger.exception("Recommendation model build failed")
+            try:
+                await asyncio.wait_for(self._stale.wait(), self.refresh_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def record_completions(self, completed: List[dict]):
+        # Popularity moves immediately; new co-completion pairs are picked up by the next build
+        model = self.model
+        for progress in completed:
+            if model is not None:
+                model.record(_item_key(progress))
+            self.invalidate(progress["user_id"])
+
+    def invalidate(self, user_id: str):
+        self.cache.invalidate(user_id)
+
+    async def recommend(self, user_id: str, limit: int) -> List[Recommendation]:
+        cached = self.cache.get(user_id)
+        if cached is not None and len(cached) >= limit:
+            return cached[:limit]
+        await self.ensure_built()
+        model = self.model
+        if not model.keys:
+            return []
+        history = await db.progress.find(
+            {"user_id": user_id},
+            {"_id": 0, "session_id": 1, "program_id": 1, "completed": 1, "progress_percentage": 1},
+        ).to_list(None)
+        scores = model.score(user_id, history)
+        count = min(limit, int(np.isfinite(scores).sum()))
+        if count == 0:
+            return []
+        top = np.argpartition(-scores, count - 1)[:count]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        recommendations = [
+            Recommendation(
+                type=model.keys[i][0],
+                score=round(float(scores[i]), 4),
+                **{field: model.docs[i].get(field) for field in ("id", "title", "category", "image", "trainer_name", "duration")},
+            )
+            for i in top
+        ]
+        self.cache.set(user_id, recommendations)
+        return recommendations
+
+recommendation_engine = RecommendationEngine(
+    RECOMMENDATION_MAX_NEIGHBOURS,
+    RECOMMENDATION_REFRESH_SECONDS,
+    LRUCache(True, RECOMMENDATION_CACHE_SIZE, RECOMMENDATION_CACHE_TTL_SECONDS),
+)
+catalog_cache.subscribe(recommendation_engine.on_catalog)
+
+@api_router.get("/recommendations", response_model=List[Recommendation])
+async def get_recommendations(
+    limit: int = Query(10, ge=1, le=50),
+    current_user: dict = Depends(get_current_user),
+):
+    return await recommendation_engine.recommend(current_user["id"], limit)
+
+def week_start(day: str) -> str:
+    start = date.fromisoformat(day)
+    return (start - timedelta(days=start.weekday())).isoformat()
+
+class RankedBoard:
+    # Kept sorted by (-score, user_id) so the top N is a slice
+    def __init__(self):
+        self.scores = {}
+        self._order = []
+
+    def set(self, user_id: str, score: int):
+        old = self.scores.pop(user_id, None)
+        if old is not None:
+            del self._order[bisect_left(self._order, (-old, user_id))]
+        if score > 0:
+            self.scores[user_id] = score
+            insort(self._order, (-score, user_id))
+
+    def top(self, limit: int) -> List[tuple]:
+        return [(user_id, -score) for score, user_id in self._order[:limit]]
+
+    def clear(self):
+        self.scores.clear()
+        self._order.clear()
+
+class Leaderboard:
+    # Minutes this week are counted locally as practice is recorded and pushed to Mongo as $inc-style
+    # deltas; streaks are copied from progress_rollups at checkpoint time. Each checkpoint also pulls
+    # back entries changed by other workers, so every process converges on the same boards.
+    def __init__(self, checkpoint_seconds: float):
+        self.checkpoint_seconds = checkpoint_seconds
+        self.week = None
+        self.day = None
+        self.minutes = RankedBoard()
+        self.streaks = RankedBoard()
+        self.last_days = {}
+        self.checkpoints = 0
+        self._pending = {}
+        self._dirty = set()
+        self._synced_at = None
+        self._task = None
+        self._stopping = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def roll(self, today: Optional[str] = None):
+        today = today or datetime.now(timezone.utc).date().isoformat()
+        if today == self.day:
+            return
+        self.day = today
+        if week_start(today) != self.week:
+            self.week = week_start(today)
+            self.minutes.clear()
+            self._pending.clear()
+        yesterday = _previous_day(today)
+        for user_id, last_day in list(self.last_days.items()):
+            if last_day < yesterday:
+                self.streaks.set(user_id, 0)
+                del self.last_days[user_id]
+
+    def record(self, practiced: List[tuple]):
+        self.roll()
+        for user_id, day, minutes in practiced:
+            self._dirty.add(user_id)
+            if minutes and week_start(day) == self.week:
+                self.minutes.set(user_id, self.minutes.scores.get(user_id, 0) + minutes)
+                self._pending[user_id] = self._pending.get(user_id, 0) + minutes
+
+    def apply(self, doc: dict):
+        user_id = doc["_id"]
+        if doc.get("week") == self.week:
+            self.minutes.set(user_id, doc.get("minutes", 0) + self._pending.get(user_id, 0))
+        self.apply_streak(user_id, doc.get("current_streak", 0), doc.get("last_practice_date"))
+
+    def apply_streak(self, user_id: str, streak: int, last_day: Optional[str]):
+        if last_day and last_day >= _previous_day(self.day):
+            self.streaks.set(user_id, streak)
+            self.last_days[user_id] = last_day
+        else:
+            self.streaks.set(user_id, 0)
+            self.last_days.pop(user_id, None)
+
+    async def load(self):
+        self.roll()
+        self._synced_at = datetime.now(timezone.utc)
+        async for doc in db.leaderboard.find({"week": self.week}):
+            self.apply(doc)
+        # Rollups are the source of streaks; users who have not practised since the leaderboard
+        # existed (or whose rollups were rebuilt) have no leaderboard document yet
+        live_rollups = db.progress_rollups.find(
+            {"last_practice_date": {"$gte": _previous_day(self.day)}},
+            {"_id": 0, "user_id": 1, "current_streak": 1, "last_practice_date": 1},
+        )
+        async for rollup in live_rollups.batch_size(5000):
+            self.apply_streak(rollup["user_id"], rollup.get("current_streak", 0), rollup["last_practice_date"])
+
+    async def checkpoint(self):
+        async with self._lock:
+            self.roll()
+            pending, self._pending = self._pending, {}
+            dirty, self._dirty = self._dirty | set(pending), set()
+            now = datetime.now(timezone.utc)
+            try:
+                if dirty:
+                    rollups = {
+                        doc["user_id"]: doc
+                        async for doc in db.progress_rollups.find(
+                            {"user_id": {"$in": list(dirty)}},
+                            {"_id": 0, "user_id": 1, "current_streak": 1, "last_practice_date": 1},
+                        )
+                    }
+                    operations = []
+                    for user_id in dirty:
+                        delta = pending.get(user_id, 0)
+                        rollup = rollups.get(user_id, {})
+                        operations.append(UpdateOne({"_id": user_id}, [{"$set": {
+                            "minutes": {"$cond": [
+                                {"$eq": ["$week", self.week]},
+                                {"$add": [{"$ifNull": ["$minutes", 0]}, delta]},
+                                delta,
+                            ]},
+                            "week": self.week,
+                            "current_streak": rollup.get("current_streak", 0),
+                            "last_practice_date": rollup.get("last_practice_date"),
+                            "updated_at": now,
+                        }}], upsert=True))
+                    await db.leaderboard.bulk_write(operations, ordered=False)
+                since = (self._synced_at or now) - timedelta(seconds=self.checkpoint_seconds)
+                async for doc in db.leaderboard.find({"updated_at": {"$gte": since}}):
+                    self.apply(doc)
+            except Exception:
+                logger.exception("Leaderboard checkpoint failed, retrying %d users", len(dirty))
+                for user_id, delta in pending.items():
+                    self._pending[user_id] = self._pending.get(user_id, 0) + delta
+                self._dirty |= dirty
+                return
+            self._synced_at = now
+            self.checkpoints += 1
+
+    async def _run(self):
+        # Stopped through _stopping like ProgressWriteBuffer: a cancelled checkpoint would lose the
+        # deltas it had already swapped out of _pending
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.checkpoint_seconds)
+            except asyncio.TimeoutError:
+                pass
+            await self.checkpoint()
+
+    def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.checkpoint()
+
+leaderboard = Leaderboard(LEADERBOARD_CHECKPOINT_SECONDS)
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: str
+    name: str
+    profile_image: Optional[str] = None
+    value: int
+
+class LeaderboardResponse(BaseModel):
+    week: str
+    minutes: List[LeaderboardEntry]
+    streaks: List[LeaderboardEntry]
+
+async def leaderboard_entries(ranked: List[tuple]) -> List[LeaderboardEntry]:
+    users = await asyncio.gather(*(load_user(user_id) for user_id, _ in ranked))
+    return [
+        LeaderboardEntry(rank=rank, user_id=user_id, name=user["name"], profile_image=user.get("profile_image"), value=value)
+        for rank, ((user_id, value), user) in enumerate(zip(ranked, users), start=1)
+        if user is not None
+    ]
+
+@api_router.get("/leaderboard", response_model=LeaderboardResponse)
+async def get_leaderboard(
+    limit: int = Query(10, ge=1, le=LEADERBOARD_MAX_LIMIT),
+    current_user: dict = Depends(get_current_user),
+):
+    leaderboard.roll()
+    minutes, streaks = await asyncio.gather(
+        leaderboard_entries(leaderboard.minutes.top(limit)),
+        leaderboard_entries(leaderboard.streaks.top(limit)),
+    )
+    return LeaderboardResponse(week=leaderboard.week, minutes=minutes, streaks=streaks)
 
 @api_router.post("/seed")
 async def seed_data():
-    trainers_count = await db.trainers.count_documents({})
-    if trainers_count > 0:
-        return {"message": "Data already seeded"}
-    
     trainers = [
         {
             "id": "trainer-1",
@@ -345,21 +2553,230 @@ async def seed_data():
         }
     ]
     
-    await db.trainers.insert_many(trainers)
-    await db.sessions.insert_many(sessions)
-    await db.programs.insert_many(programs)
+    category_sessions = {}
+    for session in sessions:
+        category_sessions.setdefault(session["category"], []).append(session["id"])
+    for program in programs:
+        pool = category_sessions.get(program["category"], [])
+        program["schedule"] = [{"day": day + 1, "session_id": pool[day % len(pool)]} for day in range(program["duration_days"])] if pool else []
+    
+    inserted = 0
+    for collection, documents in ((db.trainers, trainers), (db.sessions, sessions), (db.programs, programs)):
+        result = await collection.bulk_write(
+            [UpdateOne({"id": doc["id"]}, {"$setOnInsert": doc}, upsert=True) for doc in documents],
+            ordered=False,
+        )
+        inserted += result.upserted_count
+    if not inserted:
+        return {"message": "Data already seeded"}
+    await bump_catalog_version()
     
     return {"message": "Demo data seeded successfully"}
 
-app.include_router(api_router)
+CATALOG_IMPORT_MODELS = {"trainers": Trainer, "sessions": Session, "programs": Program}
+CATALOG_IMPORT_KINDS = {"trainer": "trainers", "session": "sessions", "program": "programs", **{kind: kind for kind in CATALOG_IMPORT_MODELS}}
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+class CatalogImportError(BaseModel):
+    line: int
+    error: str
+
+class CatalogImportReport(BaseModel):
+    dry_run: bool
+    received: int = 0
+    valid: int = 0
+    invalid: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    sessions_refreshed: int = 0
+    catalog_version: Optional[int] = None
+    errors: List[CatalogImportError] = []
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors())
+
+class CatalogImport:
+    def __init__(self, default_kind: Optional[str] = None, dry_run: bool = False, batch_size: int = IMPORT_BATCH_SIZE):
+        self.default_kind = default_kind
+        self.report = CatalogImportReport(dry_run=dry_run)
+        self.batch_size = batch_size
+        self.trainers = {}
+        self.imported_trainers = set()
+
+    def fail(self, line: int, error: str):
+        self.report.invalid += 1
+        if len(self.report.errors) < IMPORT_MAX_ERRORS:
+            self.report.errors.append(CatalogImportError(line=line, error=error))
+
+    def parse(self, line_no: int, line) -> Optional[tuple]:
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            self.fail(line_no, f"Invalid JSON: {e}")
+            return None
+        if not isinstance(record, dict):
+            self.fail(line_no, "Expected a JSON object")
+            return None
+        kind = CATALOG_IMPORT_KINDS.get(record.pop("type", None) or self.default_kind)
+        if kind is None:
+            self.fail(line_no, "Unknown record type, expected trainer, session or program")
+            return None
+        if not record.get("id"):
+            self.fail(line_no, "id is required")
+            return None
+        return kind, record
+
+    async def resolve_trainers(self, trainer_ids: set):
+        missing = [trainer_id for trainer_id in trainer_ids if trainer_id not in self.trainers]
+        if missing:
+            async for trainer in db.trainers.find({"id": {"$in": missing}}, {"_id": 0, "id": 1, "name": 1, "image": 1}):
+                self.trainers[trainer["id"]] = trainer
+
+    async def write(self, kind: str, documents: List[tuple]):
+        if self.report.dry_run or not documents:
+            return
+        try:
+            result = await db[kind].bulk_write(
+                [UpdateOne({"id": doc["id"]}, {"$set": doc}, upsert=True) for _, doc in documents],
+                ordered=False,
+            )
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for error in details["writeErrors"]:
+                self.report.valid -= 1
+                self.fail(documents[error["index"]][0], error.get("errmsg", "Write failed"))
+        self.report.inserted += details["nUpserted"]
+        self.report.updated += details["nModified"]
+        self.report.unchanged += details["nMatched"] - details["nModified"]
+
+    async def import_batch(self, batch: List[tuple]):
+        parsed = {kind: [] for kind in CATALOG_IMPORT_MODELS}
+        for line_no, line in batch:
+            record = self.parse(line_no, line)
+            if record is not None:
+                parsed[record[0]].append((line_no, record[1]))
+
+        # Trainers go first so sessions in the same batch can take their name and image
+        for kind in ("trainers", "sessions", "programs"):
+            if kind == "sessions":
+                await self.resolve_trainers({record.get("trainer_id") for _, record in parsed[kind]} - {None})
+            documents = []
+            for line_no, record in parsed[kind]:
+                if kind == "sessions":
+                    trainer = self.trainers.get(record.get("trainer_id"))
+                    if trainer is None:
+                        self.fail(line_no, f"Unknown trainer_id {record.get('trainer_id')!r}")
+                        continue
+                    record["trainer_name"] = trainer["name"]
+                    record["trainer_image"] = trainer["image"]
+                try:
+                    doc = CATALOG_IMPORT_MODELS[kind].model_validate(record).model_dump()
+                except ValidationError as e:
+                    self.fail(line_no, _validation_message(e))
+                    continue
+                if kind == "trainers":
+                    self.trainers[doc["id"]] = {"id": doc["id"], "name": doc["name"], "image": doc["image"]}
+                    self.imported_trainers.add(doc["id"])
+                documents.append((line_no, doc))
+            self.report.valid += len(documents)
+            await self.write(kind, documents)
+
+    async def refresh_sessions(self):
+        # One bulk round trip over the trainer_id index, touching only sessions whose copy is stale
+        if self.report.dry_run or not self.imported_trainers:
+            return
+        updates = []
+        for trainer_id in self.imported_trainers:
+            trainer = self.trainers[trainer_id]
+            updates.append(UpdateMany(
+                {
+                    "trainer_id": trainer_id,
+                    "$or": [{"trainer_name": {"$ne": trainer["name"]}}, {"trainer_image": {"$ne": trainer["image"]}}],
+                },
+                {"$set": {"trainer_name": trainer["name"], "trainer_image": trainer["image"]}},
+            ))
+        result = await db.sessions.bulk_write(updates, ordered=False)
+        self.report.sessions_refreshed = result.modified_count
+
+    async def run(self, lines) -> CatalogImportReport:
+        batch = []
+        line_no = 0
+        async for line in lines:
+            line_no += 1
+            if not line.strip():
+                continue
+            self.report.received += 1
+            batch.append((line_no, line))
+            if len(batch) >= self.batch_size:
+                await self.import_batch(batch)
+                batch = []
+        if batch:
+            await self.import_batch(batch)
+        await self.refresh_sessions()
+        self.report.errors.sort(key=lambda error: error.line)
+        if self.report.inserted or self.report.updated or self.report.sessions_refreshed:
+            self.report.catalog_version = await bump_catalog_version()
+        return self.report
+
+async def iter_lines(chunks):
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+@api_router.post("/admin/catalog/import", response_model=CatalogImportReport, dependencies=[Depends(require_admin)])
+async def import_catalog(
+    request: Request,
+    kind: Optional[str] = Query(None, pattern="^(trainers|sessions|programs)$"),
+    dry_run: bool = False,
+):
+    return await CatalogImport(kind, dry_run).run(iter_lines(request.stream()))
+
+@ops_router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@ops_router.get("/healthz", include_in_schema=False)
+async def healthz():
+    return {"status": "ok", "pid": os.getpid()}
+
+@ops_router.get("/readyz", include_in_schema=False)
+async def readyz(request: Request):
+    if not getattr(request.app.state, "ready", False):
+        raise HTTPException(status_code=503, detail="Starting up")
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), READINESS_PING_TIMEOUT_SECONDS)
+    except Exception:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ready", "pid": os.getpid(), "startup_seconds": request.app.state.startup_seconds}
+
+metrics.gauge("password_hash_pending", lambda: password_hasher.pending)
+metrics.gauge("password_hash_rejected_total", lambda: password_hasher.rejected)
+metrics.gauge("auth_rate_limited_total", lambda: auth_rate_limiter.rejected)
+metrics.gauge("user_cache_hits_total", lambda: user_cache.hits)
+metrics.gauge("user_cache_misses_total", lambda: user_cache.misses)
+metrics.gauge("user_cache_evictions_total", lambda: user_cache.evictions)
+metrics.gauge("user_cache_size", lambda: len(user_cache._entries))
+metrics.gauge("catalog_version", lambda: catalog_cache.snapshot.version if catalog_cache.snapshot else 0)
+metrics.gauge("catalog_loads_total", lambda: catalog_cache.loads)
+metrics.gauge("program_detail_cache_hits_total", lambda: program_detail_cache.hits)
+metrics.gauge("program_detail_cache_misses_total", lambda: program_detail_cache.misses)
+metrics.gauge("program_detail_coalesced_total", lambda: program_detail_flight.calls - program_detail_flight.executed)
+metrics.gauge("user_loader_requests_total", lambda: user_loader.requests)
+metrics.gauge("user_loader_queries_total", lambda: user_loader.queries)
+metrics.gauge("user_loader_saved_queries_total", lambda: user_loader.requests - user_loader.queries)
+metrics.gauge("progress_buffer_pending", lambda: len(progress_buffer._entries))
+metrics.gauge("progress_buffer_flushed_total", lambda: progress_buffer.flushed)
+metrics.gauge("progress_buffer_rejected_total", lambda: progress_buffer.rejected)
+metrics.gauge("progress_buffer_completion_failures_total", lambda: progress_buffer.completion_failures)
+metrics.gauge("leaderboard_users", lambda: len(leaderboard.minutes.scores))
+metrics.gauge("leaderboard_checkpoints_total", lambda: leaderboard.checkpoints)
+metrics.gauge("recommendation_builds_total", lambda: recommendation_engine.builds)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -367,6 +2784,82 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
+async def create_db_indexes():
+    if not AUTO_CREATE_INDEXES:
+        return
+    try:
+        report = await ensure_indexes()
+    except Exception:
+        logger.exception("Index reconciliation failed")
+        return
+    for collection_name, changes in report.items():
+        if changes["created"]:
+            logger.info("Created indexes on %s: %s", collection_name, ", ".join(changes["created"]))
+
+async def warm_catalog():
+    if not WARM_CATALOG_ON_STARTUP:
+        return
+    try:
+        await catalog_cache.get()
+    except Exception:
+        logger.exception("Catalog warm-up failed, it will load on first request")
+
+async def warm_leaderboard():
+    try:
+        await leaderboard.load()
+    except Exception:
+        logger.exception("Leaderboard load failed, starting from an empty board")
+
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await progress_buffer.stop()
+    await leaderboard.stop()
+    await recommendation_engine.stop()
+    password_hasher.shutdown()
+    close_db()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    app.state.ready = False
+    init_db()
+    await create_db_indexes()
+    await warm_catalog()
+    await warm_leaderboard()
+    if PROGRESS_WRITE_BEHIND:
+        progress_buffer.start()
+    leaderboard.start()
+    recommendation_engine.start()
+    app.state.startup_seconds = round(time.perf_counter() - started, 3)
+    app.state.ready = True
+    metrics.gauge("startup_seconds", lambda: app.state.startup_seconds)
+    logger.info("Worker %s ready in %.0f ms", os.getpid(), app.state.startup_seconds * 1000)
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        await shutdown_db_client()
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse if FAST_JSON_RESPONSES else JSONResponse)
+    app.state.ready = False
+    app.state.startup_seconds = None
+    app.include_router(api_router)
+    app.include_router(ops_router)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "X-Missing-Ids", "X-Missing-Count", "ETag"],
+    )
+
+    if BrotliMiddleware is not None:
+        app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE, gzip_fallback=True)
+    else:
+        app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+    app.add_middleware(MetricsMiddleware)
+    return app
+
+app = create_app()
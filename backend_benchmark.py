@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 2) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 50), 2),
+        "p95_ms": round(percentile(samples, 95), 2),
+        "p99_ms": round(percentile(samples, 99), 2),
+        "max_ms": round(max(samples), 2) if samples else 0.0,
+    }
+
+
+class LoginBurstBenchmark:
+    """Measure catalog latency while a burst of logins is being verified"""
+
+    def __init__(self, base_url, logins, login_concurrency, probe_concurrency):
+        self.api_url = f"{base_url}/api"
+        self.logins = logins
+        self.login_concurrency = login_concurrency
+        self.probe_concurrency = probe_concurrency
+        self.credentials = {
+            "name": "Benchmark User",
+            "email": f"bench{int(time.time())}@yoga.com",
+            "password": "password123",
+        }
+
+    async def prepare(self, client):
+        await client.post(f"{self.api_url}/seed")
+        response = await client.post(f"{self.api_url}/auth/signup", json=self.credentials)
+        if response.status_code not in (200, 400):
+            raise RuntimeError(f"Signup failed: {response.status_code} {response.text}")
+
+    def login_payload(self, attempt):
+        return {"email": self.credentials["email"], "password": self.credentials["password"]}
+
+    def login_headers(self, attempt):
+        return {}
+
+    async def login_worker(self, client, queue, results):
+        while True:
+            try:
+                attempt = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            login = self.login_payload(attempt)
+            started = time.perf_counter()
+            response = await client.post(f"{self.api_url}/auth/login", json=login, headers=self.login_headers(attempt))
+            results["login"].append((time.perf_counter() - started) * 1000)
+            results["login_status"][response.status_code] = results["login_status"].get(response.status_code, 0) + 1
+
+    async def probe_worker(self, client, done, results):
+        while not done.is_set():
+            started = time.perf_counter()
+            await client.get(f"{self.api_url}/sessions")
+            results["sessions"].append((time.perf_counter() - started) * 1000)
+
+    async def measure_baseline(self, client, samples=50):
+        latencies = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            await client.get(f"{self.api_url}/sessions")
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.login_concurrency + self.probe_concurrency + 4)
+        async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+            await self.prepare(client)
+            baseline = await self.measure_baseline(client)
+
+            queue = asyncio.Queue()
+            for attempt in range(self.logins):
+                queue.put_nowait(attempt)
+            results = {"login": [], "login_status": {}, "sessions": []}
+            done = asyncio.Event()
+
+            started = time.perf_counter()
+            probes = [asyncio.create_task(self.probe_worker(client, done, results)) for _ in range(self.probe_concurrency)]
+            await asyncio.gather(*(self.login_worker(client, queue, results) for _ in range(self.login_concurrency)))
+            done.set()
+            await asyncio.gather(*probes)
+            elapsed = time.perf_counter() - started
+
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "sessions_idle": summarize(baseline),
+            "sessions_during_logins": summarize(results["sessions"]),
+            "login": summarize(results["login"]),
+            "login_status": {str(k): v for k, v in results["login_status"].items()},
+        }
+
+
+class CredentialStuffingBenchmark(LoginBurstBenchmark):
+    """Measure catalog latency while wrong-password logins for many emails hammer the server
+
+    The victims are real accounts, so every attempt that gets past the limiter costs a bcrypt
+    verification. Attempts come from many addresses via X-Forwarded-For; start the server with
+    TRUST_FORWARDED_FOR=true so the per-email buckets are what stops them.
+    """
+
+    victims = 10
+
+    async def prepare(self, client):
+        await super().prepare(client)
+        for victim in range(self.victims):
+            account = {"name": f"Victim {victim}", "email": self.victim_email(victim), "password": "correct-horse"}
+            response = await client.post(
+                f"{self.api_url}/auth/signup", json=account, headers={"X-Forwarded-For": f"192.0.2.{victim + 1}"}
+            )
+            if response.status_code not in (200, 400):
+                raise RuntimeError(f"Victim signup failed: {response.status_code} {response.text}")
+
+    def victim_email(self, victim):
+        return f"victim{victim}-{self.credentials['email']}"
+
+    def login_payload(self, attempt):
+        return {"email": self.victim_email(attempt % self.victims), "password": f"guess-{attempt}"}
+
+    def login_headers(self, attempt):
+        return {"X-Forwarded-For": f"10.{attempt >> 16 & 255}.{attempt >> 8 & 255}.{attempt & 255}"}
+
+
+class SerializationBenchmark:
+    """Compare default response validation/serialization with the orjson fast path in-process"""
+
+    def __init__(self, sizes, repeats):
+        self.sizes = sizes
+        self.repeats = repeats
+        os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+        os.environ.setdefault("DB_NAME", "benchmark")
+        os.environ["MAX_PAGE_SIZE"] = str(max(sizes))
+        sys.path.insert(0, str(Path(__file__).parent / "backend"))
+        import server
+        self.server = server
+
+    def install_catalog(self, size):
+        sessions = [
+            {
+                "id": f"session-{i:06d}",
+                "title": f"Benchmark Session {i}",
+                "trainer_id": f"trainer-{i % 50}",
+                "trainer_name": f"Trainer {i % 50}",
+                "trainer_image": f"https://images.unsplash.com/photo-{i % 50:013d}?crop=entropy&cs=srgb&fm=jpg&q=85",
+                "category": ("Yoga", "Meditation", "Sleep")[i % 3],
+                "duration": 10 + i % 50,
+                "description": "A calming session to center your thoughts and energize your body",
+                "image": f"https://images.unsplash.com/photo-{i:013d}?crop=entropy&cs=srgb&fm=jpg&q=85",
+                "video_url": f"https://example.com/video-{i}",
+            }
+            for i in range(size)
+        ]
+        cache = self.server.catalog_cache
+        cache.snapshot = self.server.CatalogSnapshot(1, [], sessions, [])
+        cache.refresh_seconds = float("inf")
+        cache._checked_at = time.monotonic()
+
+    async def measure(self, client, size, fast):
+        self.server.FAST_JSON_RESPONSES = fast
+        await client.get(f"/api/sessions?limit={size}")
+        cpu_started = time.process_time()
+        for _ in range(self.repeats):
+            response = await client.get(f"/api/sessions?limit={size}")
+            response.raise_for_status()
+        return (time.process_time() - cpu_started) / self.repeats * 1000
+
+    async def run(self):
+        if self.server.orjson is None:
+            raise RuntimeError("orjson is not installed")
+        results = []
+        transport = httpx.ASGITransport(app=self.server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for size in self.sizes:
+                self.install_catalog(size)
+                default_ms = await self.measure(client, size, fast=False)
+                fast_ms = await self.measure(client, size, fast=True)
+                results.append({
+                    "items": size,
+                    "default_cpu_ms": round(default_ms, 3),
+                    "fast_cpu_ms": round(fast_ms, 3),
+                    "saved_cpu_ms": round(default_ms - fast_ms, 3),
+                    "speedup": round(default_ms / fast_ms, 2) if fast_ms else None,
+                })
+        return {"results": results}
+
+
+def save_result(output, result):
+    try:
+        with open(output) as f:
+            runs = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        runs = []
+    runs.append(result)
+    with open(output, "w") as f:
+        json.dump(runs, f, indent=2)
+
+
+def run_login_burst(args):
+    print(f"🚀 Login burst benchmark [{args.label}] against {args.base_url}")
+    benchmark = LoginBurstBenchmark(args.base_url, args.logins, args.login_concurrency, args.probe_concurrency)
+    result = asyncio.run(benchmark.run())
+
+    idle = result["sessions_idle"]
+    busy = result["sessions_during_logins"]
+    print(f"   /api/sessions idle:          p50={idle['p50_ms']}ms p99={idle['p99_ms']}ms")
+    print(f"   /api/sessions during logins: p50={busy['p50_ms']}ms p99={busy['p99_ms']}ms")
+    print(f"   /api/auth/login:             p50={result['login']['p50_ms']}ms p99={result['login']['p99_ms']}ms statuses={result['login_status']}")
+    return result
+
+
+def run_auth_attack(args):
+    print(f"🚀 Credential stuffing benchmark [{args.label}] against {args.base_url}")
+    benchmark = CredentialStuffingBenchmark(args.base_url, args.attempts, args.attack_concurrency, args.probe_concurrency)
+    result = asyncio.run(benchmark.run())
+
+    idle = result["sessions_idle"]
+    busy = result["sessions_during_logins"]
+    print(f"   /api/sessions idle:         p50={idle['p50_ms']}ms p99={idle['p99_ms']}ms")
+    print(f"   /api/sessions under attack: p50={busy['p50_ms']}ms p99={busy['p99_ms']}ms")
+    print(f"   /api/auth/login:            p50={result['login']['p50_ms']}ms p99={result['login']['p99_ms']}ms statuses={result['login_status']}")
+    return result
+
+
+def run_serialization(args):
+    print(f"🚀 Serialization benchmark [{args.label}], {args.repeats} requests per size")
+    result = asyncio.run(SerializationBenchmark(args.sizes, args.repeats).run())
+    for row in result["results"]:
+        print(
+            f"   {row['items']:>6} items: default={row['default_cpu_ms']}ms "
+            f"fast={row['fast_cpu_ms']}ms saved={row['saved_cpu_ms']}ms ({row['speedup']}x)"
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Yoga API latency benchmarks")
+    parser.add_argument("--label", default="current", help="Run label, e.g. 'inline' or 'pooled'")
+    parser.add_argument("--output", default="backend_benchmark_results.json")
+    scenarios = parser.add_subparsers(dest="scenario", required=True)
+
+    login_burst = scenarios.add_parser(
+        "login-burst", help="Catalog latency while logins are in flight (run the server with AUTH_RATE_LIMIT_BACKEND=off)"
+    )
+    login_burst.add_argument("--base-url", default="http://localhost:8001")
+    login_burst.add_argument("--logins", type=int, default=200)
+    login_burst.add_argument("--login-concurrency", type=int, default=32)
+    login_burst.add_argument("--probe-concurrency", type=int, default=4)
+    login_burst.set_defaults(runner=run_login_burst)
+
+    auth_attack = scenarios.add_parser(
+        "auth-attack", help="Catalog latency during a simulated credential-stuffing burst (run the server with TRUST_FORWARDED_FOR=true)"
+    )
+    auth_attack.add_argument("--base-url", default="http://localhost:8001")
+    auth_attack.add_argument("--attempts", type=int, default=2000)
+    auth_attack.add_argument("--attack-concurrency", type=int, default=64)
+    auth_attack.add_argument("--probe-concurrency", type=int, default=4)
+    auth_attack.set_defaults(runner=run_auth_attack)
+
+    serialization = scenarios.add_parser("serialization", help="Per-request CPU of list response serialization")
+    serialization.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    serialization.add_argument("--repeats", type=int, default=20)
+    serialization.set_defaults(runner=run_serialization)
+
+    args = parser.parse_args()
+
+    result = args.runner(args)
+    result.update({"label": args.label, "timestamp": datetime.now().isoformat(), "scenario": args.scenario})
+    save_result(args.output, result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+from backend_benchmark import summarize
+
+ROOT_DIR = Path(__file__).parent
+BACKEND_DIR = ROOT_DIR / "backend"
+
+DEFAULT_MIX = {
+    "auth_me": 2,
+    "trainers": 2,
+    "sessions": 5,
+    "sessions_by_category": 3,
+    "session_detail": 4,
+    "programs": 3,
+    "program_detail": 2,
+    "progress_list": 2,
+    "progress_update": 3,
+}
+
+IN_MEMORY_BOOTSTRAP = """
+import sys
+import uvicorn
+from mongomock_motor import AsyncMongoMockClient
+import server
+server.client = AsyncMongoMockClient()
+server.db = server.client[server.os.environ["DB_NAME"]]
+uvicorn.run(server.app, host="127.0.0.1", port=int(sys.argv[1]), log_level="warning")
+"""
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown scenario '{name}', expected one of {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LocalServer:
+    """Start the backend on a free local port, against a local mongod or an in-memory stand-in"""
+
+    def __init__(self, mongo_url, in_memory):
+        self.mongo_url = mongo_url
+        self.in_memory = in_memory
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.process = None
+
+    def __enter__(self):
+        env = dict(os.environ, MONGO_URL=self.mongo_url, DB_NAME=f"yoga_load_test_{int(time.time())}")
+        env.setdefault("AUTH_RATE_LIMIT_BACKEND", "off")
+        if self.in_memory:
+            command = [sys.executable, "-c", IN_MEMORY_BOOTSTRAP, str(self.port)]
+        else:
+            command = [sys.executable, "-m", "uvicorn", "server:app", "--port", str(self.port), "--log-level", "warning"]
+        self.process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("Backend exited during startup")
+            try:
+                if httpx.get(f"{self.base_url}/readyz", timeout=1).status_code == 200:
+                    return self
+            except httpx.TransportError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("Backend did not start within 30s")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+
+class VirtualUser:
+    """One simulated client running the same calls as YogaAppAPITester"""
+
+    def __init__(self, runner, index):
+        self.runner = runner
+        self.index = index
+        self.headers = {}
+        self.email = f"load{runner.run_id}-{index}@yoga.com"
+
+    async def call(self, name, method, endpoint, expected_status=200, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.runner.client.request(method, f"{self.runner.api_url}/{endpoint}", headers=self.headers, **kwargs)
+            ok = response.status_code == expected_status
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.runner.record(name, (time.perf_counter() - started) * 1000, ok)
+        return response if ok else None
+
+    async def authenticate(self):
+        user = {"name": f"Load User {self.index}", "email": self.email, "password": "password123"}
+        await self.call("POST /auth/signup", "POST", "auth/signup", json=user)
+        response = await self.call("POST /auth/login", "POST", "auth/login", json={"email": self.email, "password": "password123"})
+        if response is not None:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return response is not None
+
+    async def auth_me(self):
+        await self.call("GET /auth/me", "GET", "auth/me")
+
+    async def trainers(self):
+        await self.call("GET /trainers", "GET", "trainers")
+
+    async def sessions(self):
+        await self.call("GET /sessions", "GET", "sessions")
+
+    async def sessions_by_category(self):
+        category = random.choice(["Yoga", "Meditation", "Sleep"])
+        await self.call("GET /sessions?category", "GET", "sessions", params={"category": category})
+
+    async def session_detail(self):
+        await self.call("GET /sessions/{id}", "GET", f"sessions/{random.choice(self.runner.session_ids)}")
+
+    async def programs(self):
+        await self.call("GET /programs", "GET", "programs")
+
+    async def program_detail(self):
+        await self.call("GET /programs/{id}", "GET", f"programs/{random.choice(self.runner.program_ids)}")
+
+    async def progress_list(self):
+        await self.call("GET /progress", "GET", "progress")
+
+    async def progress_update(self):
+        update = {
+            "session_id": random.choice(self.runner.session_ids),
+            "progress_percentage": random.choice([25, 50, 75, 100]),
+        }
+        update["completed"] = update["progress_percentage"] == 100
+        await self.call("POST /progress", "POST", "progress", json=update)
+
+    async def run(self, deadline):
+        if not await self.authenticate():
+            return
+        names = list(self.runner.mix)
+        weights = list(self.runner.mix.values())
+        while time.monotonic() < deadline:
+            await getattr(self, random.choices(names, weights)[0])()
+
+
+class LoadTestRunner:
+    def __init__(self, base_url, users, duration, mix, seed):
+        self.api_url = f"{base_url}/api"
+        self.users = users
+        self.duration = duration
+        self.mix = mix
+        self.run_id = int(time.time())
+        self.samples = {}
+        self.errors = {}
+        self.session_ids = []
+        self.program_ids = []
+        self.client = None
+        random.seed(seed)
+
+    def record(self, name, latency_ms, ok):
+        self.samples.setdefault(name, []).append(latency_ms)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    async def prepare(self):
+        await self.client.post(f"{self.api_url}/seed")
+        sessions = (await self.client.get(f"{self.api_url}/sessions")).json()
+        programs = (await self.client.get(f"{self.api_url}/programs")).json()
+        self.session_ids = [session["id"] for session in sessions]
+        self.program_ids = [program["id"] for program in programs]
+        if not self.session_ids or not self.program_ids:
+            raise RuntimeError("Catalog is empty after seeding")
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.users, max_keepalive_connections=self.users)
+        async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+            self.client = client
+            await self.prepare()
+            started = time.monotonic()
+            deadline = started + self.duration
+            await asyncio.gather(*(VirtualUser(self, i).run(deadline) for i in range(self.users)))
+            elapsed = time.monotonic() - started
+
+        endpoints = {}
+        for name, samples in sorted(self.samples.items()):
+            endpoints[name] = summarize(samples)
+            endpoints[name]["errors"] = self.errors.get(name, 0)
+            endpoints[name]["throughput_rps"] = round(len(samples) / elapsed, 2)
+        total = sum(len(samples) for samples in self.samples.values())
+        return {
+            "users": self.users,
+            "duration_s": round(elapsed, 2),
+            "mix": self.mix,
+            "total_requests": total,
+            "total_errors": sum(self.errors.values()),
+            "throughput_rps": round(total / elapsed, 2),
+            "endpoints": endpoints,
+        }
+
+
+def find_regressions(previous, current, threshold_pct):
+    regressions = []
+    for name, stats in current["endpoints"].items():
+        before = previous["endpoints"].get(name)
+        if not before or not before["p95_ms"]:
+            continue
+        change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        if change > threshold_pct:
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {stats['p95_ms']}ms (+{change:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test for the Yoga API")
+    parser.add_argument("--base-url", help="Test an already running server instead of starting one")
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--in-memory", action="store_true", help="Run the local server against mongomock instead of mongod")
+    parser.add_argument("--users", type=int, default=50, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="e.g. sessions=5,progress_update=2")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--label", default="current")
+    parser.add_argument("--output", default=str(ROOT_DIR / "backend_load_test_results.json"))
+    parser.add_argument("--fail-on-regression", type=float, metavar="PCT", help="Exit 1 if any p95 grew more than PCT%% vs the previous run")
+    args = parser.parse_args()
+
+    print("🚀 Starting Yoga App load test")
+    print("=" * 50)
+    if args.base_url:
+        result = asyncio.run(LoadTestRunner(args.base_url, args.users, args.duration, args.mix, args.seed).run())
+    else:
+        with LocalServer(args.mongo_url, args.in_memory) as server:
+            print(f"   Local server: {server.base_url} ({'in-memory' if args.in_memory else args.mongo_url})")
+            result = asyncio.run(LoadTestRunner(server.base_url, args.users, args.duration, args.mix, args.seed).run())
+    result.update({"label": args.label, "timestamp": datetime.now().isoformat()})
+
+    print(f"\n{'endpoint':<24}{'count':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'errors':>8}")
+    for name, stats in result["endpoints"].items():
+        print(
+            f"{name:<24}{stats['count']:>8}{stats['throughput_rps']:>9}"
+            f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats['errors']:>8}"
+        )
+    print("=" * 50)
+    print(f"📊 {result['total_requests']} requests, {result['throughput_rps']} req/s, {result['total_errors']} errors")
+
+    try:
+        with open(args.output) as f:
+            runs = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        runs = []
+    regressions = find_regressions(runs[-1], result, args.fail_on_regression) if runs and args.fail_on_regression is not None else []
+    runs.append(result)
+    with open(args.output, "w") as f:
+        json.dump(runs, f, indent=2)
+
+    for regression in regressions:
+        print(f"⚠️  {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "yoga_test")
+os.environ.setdefault("ADMIN_API_KEY", "test-admin-key")
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+import server as backend  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """The backend module against a fresh in-memory database, with its caches and buffers reset"""
+    mock = AsyncMongoMockClient()
+    monkeypatch.setattr(backend, "client", mock)
+    monkeypatch.setattr(backend, "db", mock["yoga_test"])
+    catalog_cache = backend.CatalogCache(backend.CATALOG_REFRESH_SECONDS)
+    search_index = backend.SearchIndex(backend.SEARCH_MIN_PREFIX_LENGTH, backend.SEARCH_MAX_PREFIX_TOKENS, 100)
+    catalog_cache.subscribe(search_index.sync)
+    monkeypatch.setattr(backend, "catalog_cache", catalog_cache)
+    monkeypatch.setattr(backend, "search_index", search_index)
+    monkeypatch.setattr(backend, "program_detail_cache", backend.LRUCache(True, 100))
+    monkeypatch.setattr(backend, "program_detail_flight", backend.SingleFlight())
+    monkeypatch.setattr(backend, "user_cache", backend.LRUCache(True, 100))
+    monkeypatch.setattr(backend, "user_loader", backend.UserLoader("users"))
+    monkeypatch.setattr(backend, "progress_buffer", backend.ProgressWriteBuffer(60, 100, 2))
+    monkeypatch.setattr(backend, "leaderboard", backend.Leaderboard(60))
+    monkeypatch.setattr(backend, "auth_rate_limiter", backend.AuthRateLimiter(backend.MemoryBucketStore(1000)))
+    monkeypatch.setattr(
+        backend, "recommendation_engine", backend.RecommendationEngine(100, 900, backend.LRUCache(True, 100))
+    )
+    return backend
+
+
+@pytest.fixture
+def run():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop.run_until_complete
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+@pytest.fixture
+def api(server):
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def catalog(server, run):
+    trainers = [{"id": "t1", "name": "Asha", "bio": "Teaches hatha", "image": "https://example.com/t1.jpg", "specialization": "Yoga"}]
+    sessions = [
+        {
+            "id": f"s{i}",
+            "title": f"Session {i}",
+            "trainer_id": "t1",
+            "trainer_name": "Asha",
+            "trainer_image": "https://example.com/t1.jpg",
+            "category": "Yoga" if i % 2 else "Meditation",
+            "duration": 10 + i,
+            "description": "A calming session",
+            "image": f"https://example.com/s{i}.jpg",
+            "video_url": f"https://example.com/s{i}.mp4",
+        }
+        for i in range(1, 6)
+    ]
+    programs = [
+        {
+            "id": "p1",
+            "title": "Seven Days",
+            "description": "A week of practice",
+            "image": "https://example.com/p1.jpg",
+            "category": "Yoga",
+            "duration_days": 7,
+            "sessions_count": 2,
+            "schedule": [{"day": 1, "session_id": "s1"}, {"day": 2, "session_id": "s3"}],
+        }
+    ]
+
+    async def insert():
+        await server.db.trainers.insert_many([dict(doc) for doc in trainers])
+        await server.db.sessions.insert_many([dict(doc) for doc in sessions])
+        await server.db.programs.insert_many([dict(doc) for doc in programs])
+        await server.bump_catalog_version()
+
+    run(insert())
+    return {"trainers": trainers, "sessions": sessions, "programs": programs}
+
+
+@pytest.fixture
+def user(server, run):
+    user = {"id": "user-1", "email": "user1@yoga.com", "name": "User One", "password": "hash", "is_premium": False}
+    run(server.db.users.insert_one(server.user_to_storage(dict(user))))
+    return user
+
+
+@pytest.fixture
+def auth(server, user):
+    return {"Authorization": f"Bearer {server.create_access_token({'sub': user['id']})}"}
@@ -0,0 +1,87 @@
+import pytest
+
+
+@pytest.fixture
+def claims(server, monkeypatch):
+    monkeypatch.setattr(server, "CLAIMS_TOKENS_ENABLED", True)
+
+    async def verify(plain_password, hashed_password):
+        return plain_password == "right"
+
+    monkeypatch.setattr(server.password_hasher, "verify", verify)
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_claims_tokens_skip_the_user_lookup(server, api, catalog, user, claims, monkeypatch):
+    tokens = api.post("/api/auth/login", json={"email": user["email"], "password": "right"}).json()
+    assert tokens["refresh_token"] and tokens["expires_in"] == server.CLAIMS_ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    payload = server.decode_token(tokens["access_token"])
+    assert payload["claims"] == {field: user.get(field) for field in server.CLAIMS_FIELDS}
+
+    async def no_lookup(user_id):
+        raise AssertionError("claims tokens must not load the user")
+
+    monkeypatch.setattr(server, "load_user", no_lookup)
+    assert api.get("/api/progress", headers=bearer(tokens["access_token"])).status_code == 200
+
+
+def test_refresh_issues_new_tokens(server, api, user, claims):
+    tokens = api.post("/api/auth/login", json={"email": user["email"], "password": "right"}).json()
+    refreshed = api.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert refreshed.status_code == 200
+    assert refreshed.json()["user"]["id"] == user["id"]
+    assert api.get("/api/auth/me", headers=bearer(refreshed.json()["access_token"])).json()["email"] == user["email"]
+
+
+def test_refresh_and_access_tokens_are_not_interchangeable(server, api, user, claims):
+    tokens = api.post("/api/auth/login", json={"email": user["email"], "password": "right"}).json()
+
+    assert api.get("/api/auth/me", headers=bearer(tokens["refresh_token"])).status_code == 401
+    assert api.post("/api/auth/refresh", json={"refresh_token": tokens["access_token"]}).status_code == 401
+    assert api.post("/api/auth/refresh", json={"refresh_token": "garbage"}).status_code == 401
+
+
+def test_refresh_for_a_deleted_user_fails(server, api, run, user, claims):
+    refresh_token = server.create_refresh_token(user["id"])
+    run(server.db.users.delete_one({"id": user["id"]}))
+    assert api.post("/api/auth/refresh", json={"refresh_token": refresh_token}).status_code == 401
+
+
+def test_refresh_is_off_without_claims_tokens(server, api, user):
+    refresh_token = server.create_refresh_token(user["id"])
+    assert api.post("/api/auth/refresh", json={"refresh_token": refresh_token}).status_code == 404
+
+
+def test_rate_limited_logins_never_reach_bcrypt(server, api, user, monkeypatch):
+    verified = []
+
+    async def verify(plain_password, hashed_password):
+        verified.append(plain_password)
+        return False
+
+    monkeypatch.setattr(server.password_hasher, "verify", verify)
+    statuses = [
+        api.post("/api/auth/login", json={"email": user["email"], "password": f"guess-{i}"}).status_code
+        for i in range(8)
+    ]
+
+    burst = int(server.AUTH_RATE_LIMIT_EMAIL_BURST)
+    assert statuses == [401] * burst + [429] * (8 - burst)
+    assert len(verified) == burst
+    limited = api.post("/api/auth/login", json={"email": user["email"].upper(), "password": "again"})
+    assert limited.status_code == 429 and int(limited.headers["Retry-After"]) >= 1
+    assert server.auth_rate_limiter.rejected == 8 - burst + 1
+
+
+def test_signup_shares_the_email_bucket(server, api, user, monkeypatch):
+    async def hash_password(password):
+        raise AssertionError("a limited signup must not hash")
+
+    monkeypatch.setattr(server.password_hasher, "hash", hash_password)
+    monkeypatch.setattr(server, "AUTH_RATE_LIMIT_EMAIL_BURST", 1)
+    new_user = {"email": "new@yoga.com", "name": "New", "password": "secret"}
+    assert api.post("/api/auth/login", json={"email": new_user["email"], "password": "x"}).status_code == 401
+    assert api.post("/api/auth/signup", json=new_user).status_code == 429
@@ -0,0 +1,90 @@
+import base64
+import json
+
+ADMIN = {"X-Admin-Key": "test-admin-key"}
+
+
+def jsonl(*records):
+    return "\n".join(json.dumps(record) for record in records)
+
+
+def test_cursor_pagination_walks_the_catalog(api, catalog):
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = api.get("/api/sessions", params=params)
+        seen += [session["id"] for session in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == sorted(session["id"] for session in catalog["sessions"])
+    assert api.get("/api/sessions", params={"cursor": "not-a-cursor"}).status_code == 400
+    # Well-formed JSON whose "after" is not an id
+    for after in (5, None, ["s1"]):
+        cursor = base64.urlsafe_b64encode(json.dumps({"after": after}).encode()).decode()
+        assert api.get("/api/sessions", params={"cursor": cursor}).status_code == 400
+
+
+def test_ndjson_streams_one_object_per_line(api, catalog):
+    response = api.get("/api/sessions", params={"format": "ndjson", "category": "Yoga"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == ["s1", "s3", "s5"]
+
+
+def test_ids_keep_their_order_and_report_missing(api, catalog):
+    response = api.get("/api/sessions", params={"ids": "s3,nope,s1,s3"})
+    assert [session["id"] for session in response.json()] == ["s3", "s1"]
+    assert response.headers["X-Missing-Count"] == "1"
+    assert response.headers["X-Missing-Ids"] == "nope"
+
+
+def test_missing_ids_header_is_capped(server, api, catalog, monkeypatch):
+    monkeypatch.setattr(server, "MISSING_IDS_HEADER_MAX_BYTES", 20)
+    ids = ",".join(f"missing-{i}" for i in range(10))
+    response = api.get("/api/sessions", params={"ids": ids})
+    assert response.headers["X-Missing-Count"] == "10"
+    assert response.headers["X-Missing-Ids"] == "missing-0,missing-1"
+
+
+def test_etag_answers_304_until_the_catalog_changes(server, run, api, catalog):
+    first = api.get("/api/programs")
+    etag = first.headers["ETag"]
+    assert api.get("/api/programs", headers={"If-None-Match": etag}).status_code == 304
+    assert api.get("/api/programs", headers={"If-None-Match": f'W/{etag}, "other"'}).status_code == 304
+    # Another query string is another representation
+    assert api.get("/api/programs?limit=1", headers={"If-None-Match": etag}).status_code == 200
+
+    run(server.bump_catalog_version())
+    assert api.get("/api/programs", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_import_upserts_and_refreshes_sessions(server, run, api, catalog):
+    body = jsonl(
+        {"type": "trainer", "id": "t1", "name": "Asha R", "bio": "Teaches hatha", "image": "https://example.com/t1b.jpg",
+         "specialization": "Yoga"},
+        {"type": "session", "id": "s9", "title": "New", "trainer_id": "t1", "category": "Sleep", "duration": 15,
+         "description": "Wind down", "image": "https://example.com/s9.jpg"},
+        {"type": "session", "id": "s10", "title": "Orphan", "trainer_id": "t404", "category": "Sleep", "duration": 15,
+         "description": "No trainer", "image": "https://example.com/s10.jpg"},
+        {"type": "program", "id": "p2", "title": "Missing fields"},
+    ) + "\nnot json\n"
+    report = api.post("/api/admin/catalog/import", content=body, headers=ADMIN).json()
+
+    assert (report["received"], report["valid"], report["invalid"]) == (5, 2, 3)
+    assert (report["inserted"], report["updated"]) == (1, 1)
+    assert [error["line"] for error in report["errors"]] == [3, 4, 5]
+    assert report["sessions_refreshed"] == len(catalog["sessions"])
+    assert report["catalog_version"] is not None
+
+    sessions = {session["id"]: session for session in api.get("/api/sessions").json()}
+    assert sessions["s9"]["trainer_name"] == "Asha R"
+    assert sessions["s1"]["trainer_image"] == "https://example.com/t1b.jpg"
+
+
+def test_import_dry_run_writes_nothing(server, run, api, catalog):
+    body = jsonl({"id": "t2", "name": "Ravi", "bio": "Breathwork", "image": "https://example.com/t2.jpg", "specialization": "Breath"})
+    report = api.post("/api/admin/catalog/import?kind=trainers&dry_run=true", content=body, headers=ADMIN).json()
+
+    assert (report["valid"], report["inserted"], report["catalog_version"]) == (1, 0, None)
+    assert run(server.db.trainers.count_documents({"id": "t2"})) == 0
+    assert api.post("/api/admin/catalog/import", content=body).status_code == 403
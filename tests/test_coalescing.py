@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+
+def test_batch_loader_sends_one_query_per_tick(server, run):
+    run(server.db.trainers.insert_many([{"id": f"t{i}", "name": f"Trainer {i}"} for i in range(3)]))
+    loader = server.BatchLoader("trainers", projection={"_id": 0})
+
+    async def load():
+        return await asyncio.gather(*(loader.load(key) for key in ("t0", "t1", "t0", "missing", "t2")))
+
+    docs = run(load())
+    assert [doc and doc["id"] for doc in docs] == ["t0", "t1", "t0", None, "t2"]
+    assert (loader.requests, loader.queries) == (5, 1)
+    assert loader._inflight == {} and loader._pending == {}
+
+
+def test_batch_loader_splits_large_batches(server, run):
+    loader = server.BatchLoader("trainers", max_batch=2)
+    run(asyncio.gather(*(loader.load(f"t{i}") for i in range(5))))
+    assert loader.queries == 3
+
+
+def test_batch_loader_fails_every_waiter(server, run, monkeypatch):
+    loader = server.BatchLoader("trainers")
+
+    def broken(values):
+        raise RuntimeError("bad query")
+
+    monkeypatch.setattr(loader, "query", broken)
+    results = run(asyncio.gather(loader.load("t1"), loader.load("t2"), return_exceptions=True))
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert loader._inflight == {}
+
+
+def test_single_flight_shares_one_call(server, run):
+    flight = server.SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return {"value": len(calls)}
+
+    results = run(asyncio.gather(*(flight.do("key", fetch) for _ in range(4))))
+    assert results == [{"value": 1}] * 4
+    assert (flight.calls, flight.executed) == (4, 1)
+    # Finished calls are released, so the next one runs again
+    assert run(flight.do("key", fetch)) == {"value": 2}
+
+
+def test_single_flight_propagates_errors(server, run):
+    flight = server.SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    async def both():
+        return await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+
+    assert [type(result) for result in run(both())] == [ValueError, ValueError]
+    assert flight.executed == 1
+    with pytest.raises(ValueError):
+        run(flight.do("key", fail))
@@ -0,0 +1,59 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+ADMIN = {"X-Admin-Key": "test-admin-key"}
+
+
+def insert_rows(server, run):
+    # Two rows share each updated_at, and _ids do not follow insertion order
+    start = datetime(2024, 5, 1, 8, 0)
+    ids = sorted(ObjectId() for _ in range(6))
+    rows = [
+        {"_id": ids[5 - i], "id": f"row-{i}", "user_id": "u1", "session_id": f"s{i}", "progress_percentage": 10 * i,
+         "updated_at": start + timedelta(minutes=i // 2)}
+        for i in range(6)
+    ]
+    # Changed just now, so not settled yet
+    rows.append({"id": "fresh", "user_id": "u1", "session_id": "s9", "updated_at": datetime.now(timezone.utc).replace(tzinfo=None)})
+    run(server.db.progress.insert_many(rows))
+    return [str(row["_id"]) for row in sorted(rows[:6], key=lambda row: (row["updated_at"], row["_id"]))]
+
+
+def collect(server, run, query, batch_size):
+    async def drain():
+        return [chunk async for chunk in server.export_progress(query, "ndjson", batch_size)]
+
+    chunks = run(drain())
+    return [[json.loads(line)["_id"] for line in chunk.decode().splitlines()] for chunk, _ in chunks], chunks
+
+
+def test_export_is_ordered_by_update_time_then_id(server, run):
+    expected = insert_rows(server, run)
+    batches, chunks = collect(server, run, server.progress_export_query(), 4)
+
+    assert batches == [expected[:4], expected[4:]]
+    assert chunks[0][1] == server.export_checkpoint(json.loads(chunks[0][0].decode().splitlines()[-1]))
+
+
+def test_export_resumes_after_a_checkpoint(server, run):
+    expected = insert_rows(server, run)
+    # Each checkpoint falls between two rows with the same updated_at
+    for size in (1, 3):
+        _, chunks = collect(server, run, server.progress_export_query(), size)
+        resumed, _ = collect(server, run, server.progress_export_query(after=chunks[0][1]), 100)
+        assert resumed == [expected[size:]]
+
+
+def test_export_endpoint(server, run, api):
+    expected = insert_rows(server, run)
+    response = api.get("/api/admin/progress/export", params={"format": "csv"}, headers=ADMIN)
+    lines = response.text.splitlines()
+    assert lines[0] == ",".join(server.PROGRESS_EXPORT_FIELDS)
+    assert [line.split(",")[0] for line in lines[1:]] == expected
+
+    bounded = api.get("/api/admin/progress/export", params={"since": "2024-05-01T08:01:00Z", "until": "2024-05-01T08:02:00Z"}, headers=ADMIN)
+    assert [json.loads(line)["_id"] for line in bounded.text.splitlines()] == expected[2:4]
+    assert api.get("/api/admin/progress/export", params={"after": "2024-05-01T08:00:00,nope"}, headers=ADMIN).status_code == 400
+    assert api.get("/api/admin/progress/export").status_code == 403
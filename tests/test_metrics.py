@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+from bson import Int64
+
+
+def command_events(command_name, command, request_id):
+    started = SimpleNamespace(command_name=command_name, command=command, connection_id=("db", 27017), request_id=request_id)
+    done = SimpleNamespace(command_name=command_name, connection_id=("db", 27017), request_id=request_id, duration_micros=1500)
+    return started, done
+
+
+def test_mongo_commands_are_labelled_with_their_collection(server, monkeypatch):
+    monkeypatch.setattr(server, "metrics", server.Metrics())
+    listener = server.MongoCommandMetrics()
+    commands = [
+        ("find", {"find": "sessions", "filter": {}}),
+        ("getMore", {"getMore": Int64(7242148137485), "collection": "sessions"}),
+        ("killCursors", {"killCursors": "sessions", "cursors": [Int64(7242148137485)]}),
+        ("ping", {"ping": 1}),
+    ]
+    for request_id, (command_name, command) in enumerate(commands):
+        started, done = command_events(command_name, command, request_id)
+        listener.started(started)
+        listener.succeeded(done)
+
+    assert set(server.metrics.mongo_latency) == {
+        ("sessions", "find"), ("sessions", "getMore"), ("sessions", "killCursors"), ("", "ping")
+    }
@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+
+def test_readyz_fails_until_warm_up_has_finished(server, api):
+    assert api.get("/readyz").status_code == 503
+    assert api.get("/readyz").json()["detail"] == "Starting up"
+    assert api.get("/healthz").status_code == 200
+
+
+def test_readyz_after_startup(server, catalog, monkeypatch):
+    monkeypatch.setattr(server, "AUTO_CREATE_INDEXES", False)
+    app = server.create_app()
+    during_warm_up = []
+    warm_catalog = server.warm_catalog
+
+    async def observed_warm_catalog():
+        during_warm_up.append(app.state.ready)
+        await warm_catalog()
+
+    monkeypatch.setattr(server, "warm_catalog", observed_warm_catalog)
+    with TestClient(app) as api:
+        response = api.get("/readyz")
+        assert response.status_code == 200
+        assert response.json()["startup_seconds"] is not None
+        assert server.catalog_cache.snapshot is not None
+    assert during_warm_up == [False]
+    assert app.state.ready is False
+
+
+def test_readyz_fails_when_the_database_does_not_answer(server, api, monkeypatch):
+    async def ping(command):
+        raise ConnectionError("no primary")
+
+    monkeypatch.setattr(server, "client", SimpleNamespace(admin=SimpleNamespace(command=ping)))
+    api.app.state.ready = True
+    try:
+        response = api.get("/readyz")
+    finally:
+        api.app.state.ready = False
+    assert (response.status_code, response.json()["detail"]) == (503, "Database unavailable")
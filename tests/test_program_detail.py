@@ -0,0 +1,61 @@
+import pytest
+
+
+@pytest.fixture
+def aggregations(server, monkeypatch):
+    # mongomock's $lookup cannot match an array localField such as schedule.session_id, so the
+    # program pipeline is answered from plain finds; the test still checks which pipeline was sent
+    collection = type(server.db.programs)
+    aggregate = collection.aggregate
+    pipelines = []
+
+    class ProgramLookup:
+        def __init__(self, program_id):
+            self.program_id = program_id
+
+        async def to_list(self, length):
+            program = await server.db.programs.find_one({"id": self.program_id}, {"_id": 0})
+            if program is None:
+                return []
+            session_ids = [entry["session_id"] for entry in program.get("schedule") or []]
+            program["sessions"] = await server.db.sessions.find({"id": {"$in": session_ids}}, {"_id": 0}).to_list(None)
+            trainer_ids = [session["trainer_id"] for session in program["sessions"]]
+            program["trainers"] = await server.db.trainers.find({"id": {"$in": trainer_ids}}, {"_id": 0}).to_list(None)
+            return [program]
+
+    def stub(self, pipeline, *args, **kwargs):
+        if self.name != "programs":
+            return aggregate(self, pipeline, *args, **kwargs)
+        pipelines.append(pipeline)
+        return ProgramLookup(pipeline[0]["$match"]["id"])
+
+    monkeypatch.setattr(collection, "aggregate", stub)
+    return pipelines
+
+
+def test_program_detail_orders_sessions_by_day(server, run, api, catalog, aggregations):
+    run(server.db.programs.update_one({"id": "p1"}, {"$set": {"schedule": [
+        {"day": 3, "session_id": "s1"}, {"day": 1, "session_id": "s3"}, {"day": 2, "session_id": "gone"},
+    ]}}))
+    run(server.bump_catalog_version())
+
+    detail = api.get("/api/programs/p1/full").json()
+    assert [(session["id"], session["day"]) for session in detail["sessions"]] == [("s3", 1), ("s1", 3)]
+    assert [trainer["id"] for trainer in detail["trainers"]] == ["t1"]
+    assert aggregations == [server.program_detail_pipeline("p1")]
+
+
+def test_program_detail_is_cached_per_catalog_version(server, run, api, catalog, aggregations):
+    first = api.get("/api/programs/p1/full")
+    assert api.get("/api/programs/p1/full", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    assert api.get("/api/programs/p1/full").json() == first.json()
+    assert len(aggregations) == 1
+
+    run(server.db.sessions.update_one({"id": "s1"}, {"$set": {"title": "Renamed"}}))
+    run(server.bump_catalog_version())
+    assert api.get("/api/programs/p1/full").json()["sessions"][0]["title"] == "Renamed"
+    assert len(aggregations) == 2
+
+
+def test_missing_program_is_not_found(api, catalog, aggregations):
+    assert api.get("/api/programs/nope/full").status_code == 404
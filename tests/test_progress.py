@@ -0,0 +1,185 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+
+def test_progress_update_requires_exactly_one_item(server):
+    with pytest.raises(ValidationError):
+        server.ProgressUpdate(progress_percentage=10)
+    with pytest.raises(ValidationError):
+        server.ProgressUpdate(session_id="s1", program_id="p1")
+    with pytest.raises(ValidationError):
+        server.ProgressUpdate(session_id="s1", progress_percentage=101)
+    assert server.ProgressUpdate(program_id="p1").progress_percentage == 0
+
+
+def test_upsert_keeps_one_row_and_only_raises_progress(server, run, catalog, user):
+    first = run(server.upsert_progress(user["id"], server.ProgressUpdate(session_id="s1", progress_percentage=60)))
+    second = run(server.upsert_progress(user["id"], server.ProgressUpdate(session_id="s1", progress_percentage=20)))
+
+    assert second["id"] == first["id"]
+    assert second["progress_percentage"] == 60
+    assert second["completed"] is False
+    assert run(server.db.progress.count_documents({})) == 1
+
+
+def test_repeat_completions_count_once_per_day(server, run, api, catalog, user, auth):
+    completed = {"session_id": "s2", "completed": True, "progress_percentage": 100}
+    first = api.post("/api/progress", json=completed, headers=auth).json()
+    for _ in range(20):
+        again = api.post("/api/progress", json=completed, headers=auth).json()
+
+    assert again["completed_at"] == first["completed_at"]
+    assert again["practice_count"] == 1
+    duration = catalog["sessions"][1]["duration"]
+    summary = api.get("/api/progress/summary", headers=auth).json()
+    assert (summary["completed_sessions"], summary["minutes_practiced"]) == (1, duration)
+    assert server.leaderboard.minutes.scores[user["id"]] == duration
+
+
+def test_completion_on_a_new_day_counts_again(server, run, catalog, user):
+    # Completed before practice days were kept; its completion day counts as one practice
+    run(server.db.progress.insert_one({
+        **server.progress_key(user["id"], "s2", None),
+        "id": "legacy-row",
+        "completed": True,
+        "completed_at": "2024-05-01T08:00:00+00:00",
+        "progress_percentage": 100,
+    }))
+    progress = run(server.upsert_progress(user["id"], server.ProgressUpdate(session_id="s2", completed=True)))
+
+    assert progress["practice_count"] == 2
+    rollup = run(server.db.progress_rollups.find_one({"user_id": user["id"]}))
+    assert (rollup["completed_sessions"], rollup["minutes_practiced"]) == (0, catalog["sessions"][1]["duration"])
+
+
+def test_progress_endpoint(api, catalog, auth):
+    response = api.post("/api/progress", json={"session_id": "s1", "progress_percentage": 40}, headers=auth)
+    assert response.status_code == 200
+    assert response.json()["progress_percentage"] == 40
+    assert api.post("/api/progress", json={"progress_percentage": 40}, headers=auth).status_code == 422
+    assert api.post("/api/progress", json={"session_id": "s1"}).status_code == 403
+
+
+def test_merge_coalesces_heartbeats_per_item(server):
+    morning, noon, next_day = "2024-05-01T08:00:00+00:00", "2024-05-01T12:00:00+00:00", "2024-05-02T08:00:00+00:00"
+    completed = server.ProgressUpdate(session_id="s1", completed=True, progress_percentage=100)
+    entries = {}
+    server.merge_progress_update(entries, "u1", server.ProgressUpdate(session_id="s1", progress_percentage=30), morning)
+    server.merge_progress_update(entries, "u1", server.ProgressUpdate(session_id="s1", progress_percentage=10), morning)
+    for now in (morning, noon, next_day):
+        server.merge_progress_update(entries, "u1", completed, now)
+    server.merge_progress_update(entries, "u1", server.ProgressUpdate(program_id="p1", progress_percentage=5), morning)
+
+    assert len(entries) == 2
+    merged, completed_at, practiced = entries[("u1", "s1", None)]
+    assert (merged.progress_percentage, merged.completed, completed_at) == (100, True, morning)
+    # Only the first completed report of each day can count as practice
+    assert practiced == [morning, next_day]
+    assert entries[("u1", None, "p1")][2] == []
+
+
+def test_buffer_rejects_once_backed_up(server):
+    buffer = server.ProgressWriteBuffer(60, 4, 1)
+    entries = {}
+    for session_id in ("s1", "s2", "s3"):
+        server.merge_progress_update(entries, "u1", server.ProgressUpdate(session_id=session_id), "t1")
+    buffer.add(entries)
+
+    more = {}
+    server.merge_progress_update(more, "u1", server.ProgressUpdate(session_id="s4"), "t2")
+    server.merge_progress_update(more, "u1", server.ProgressUpdate(session_id="s5"), "t2")
+    with pytest.raises(HTTPException) as rejected:
+        buffer.add(more)
+    assert rejected.value.status_code == 503
+    assert "Retry-After" in rejected.value.headers
+    assert buffer.rejected == 1 and len(buffer._entries) == 3
+
+
+def test_failed_practice_recording_does_not_requeue(server, run, catalog, user, monkeypatch):
+    async def fail(events):
+        raise RuntimeError("rollups unavailable")
+
+    monkeypatch.setattr(server, "record_practice", fail)
+    buffer = server.ProgressWriteBuffer(60, 100, 2)
+    server.merge_progress_update(
+        buffer._entries, user["id"], server.ProgressUpdate(session_id="s1", completed=True, progress_percentage=100), "t1"
+    )
+    run(buffer.flush())
+
+    assert buffer._entries == {}
+    assert buffer.completion_failures == 1
+    assert run(server.db.progress.count_documents({"completed": True})) == 1
+
+
+def test_failed_write_requeues(server, run, user, monkeypatch):
+    async def fail(entries):
+        raise RuntimeError("mongo down")
+
+    monkeypatch.setattr(server, "write_progress_updates", fail)
+    buffer = server.ProgressWriteBuffer(60, 100, 2)
+    server.merge_progress_update(buffer._entries, user["id"], server.ProgressUpdate(session_id="s1"), "t1")
+    run(buffer.flush())
+
+    assert list(buffer._entries) == [(user["id"], "s1", None)]
+    assert buffer.flushed == 0
+
+
+def test_batch_endpoint_coalesces_per_item(server, api, catalog, auth):
+    response = api.post(
+        "/api/progress/batch",
+        json={"updates": [{"session_id": "s2", "progress_percentage": 10}, {"session_id": "s2", "progress_percentage": 90}]},
+        headers=auth,
+    )
+    assert response.json() == {"received": 2, "coalesced": 1, "buffered": server.PROGRESS_WRITE_BEHIND}
+
+
+def test_stop_waits_for_an_in_flight_flush(server, run, catalog, user, monkeypatch):
+    write = server.write_progress_updates
+    started = asyncio.Event()
+
+    async def slow_write(entries):
+        started.set()
+        await asyncio.sleep(0.05)
+        return await write(entries)
+
+    monkeypatch.setattr(server, "write_progress_updates", slow_write)
+    buffer = server.ProgressWriteBuffer(0.01, 100, 2)
+
+    async def shutdown_mid_flush():
+        buffer.start()
+        server.merge_progress_update(buffer._entries, user["id"], server.ProgressUpdate(session_id="s1"), "t1")
+        await started.wait()
+        await buffer.stop()
+
+    run(shutdown_mid_flush())
+    assert run(server.db.progress.count_documents({"session_id": "s1"})) == 1
+    assert buffer._entries == {} and buffer.flushed == 1
+
+
+def test_partial_bulk_write_requeues_only_the_failed_upserts(server, run, catalog, user, monkeypatch):
+    from pymongo.errors import BulkWriteError
+
+    collection = type(server.db.progress)
+    bulk_write = collection.bulk_write
+
+    async def partial_bulk_write(self, operations, ordered=True):
+        if self.name != "progress":
+            return await bulk_write(self, operations, ordered=ordered)
+        await bulk_write(self, operations[:1] + operations[2:], ordered=ordered)
+        raise BulkWriteError({"writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"}]})
+
+    monkeypatch.setattr(collection, "bulk_write", partial_bulk_write)
+    buffer = server.ProgressWriteBuffer(60, 100, 2)
+    for session_id in ("s1", "s2", "s3"):
+        server.merge_progress_update(
+            buffer._entries, user["id"], server.ProgressUpdate(session_id=session_id, completed=True), "2024-05-01T08:00:00+00:00"
+        )
+    run(buffer.flush())
+
+    assert list(buffer._entries) == [(user["id"], "s2", None)]
+    assert buffer.flushed == 2
+    rollup = run(server.db.progress_rollups.find_one({"user_id": user["id"]}))
+    assert rollup["completed_sessions"] == 2
@@ -0,0 +1,51 @@
+def completed(server, user_id, session_id=None, program_id=None, **fields):
+    return {**server.progress_key(user_id, session_id, program_id), "completed": True, "progress_percentage": 100, **fields}
+
+
+def ids(recommendations):
+    return [recommendation.id for recommendation in recommendations]
+
+
+def test_new_users_get_the_most_completed_items(server, run, catalog):
+    run(server.db.progress.insert_many(
+        [completed(server, f"u{i}", "s3") for i in range(3)] + [completed(server, "u9", "s5")]
+    ))
+
+    assert ids(run(server.recommendation_engine.recommend("new-user", 2))) == ["s3", "s5"]
+
+
+def test_completed_items_are_not_recommended_again(server, run, catalog, user):
+    run(server.db.progress.insert_many([
+        completed(server, user["id"], "s1"),
+        {**server.progress_key(user["id"], "s2", None), "completed": False, "progress_percentage": 40},
+        completed(server, "u2", "s1"),
+        completed(server, "u2", "s4"),
+    ]))
+
+    recommended = ids(run(server.recommendation_engine.recommend(user["id"], 10)))
+    assert "s1" not in recommended and "s2" in recommended
+    assert len(recommended) == 5
+    # Completed alongside s1 by another user, and the same category as the half-watched s2
+    assert recommended[0] == "s4"
+
+
+def test_completions_refresh_cached_recommendations(server, run, catalog, user):
+    engine = server.recommendation_engine
+    run(engine.recommend(user["id"], 3))
+    assert engine.cache.get(user["id"]) is not None
+
+    # Other users' completions move popularity without a rebuild and leave this user's cache alone
+    engine.record_completions([completed(server, f"u{i}", "s4") for i in range(3)])
+    assert engine.cache.get(user["id"]) is not None
+    assert ids(run(engine.recommend("other", 1))) == ["s4"]
+    engine.record_completions([completed(server, user["id"], "s2")])
+    assert engine.cache.get(user["id"]) is None
+    assert engine.builds == 1
+
+
+def test_recommendations_endpoint(server, api, catalog, auth):
+    response = api.get("/api/recommendations", params={"limit": 3}, headers=auth)
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+    assert api.get("/api/recommendations").status_code == 403
+    assert api.get("/api/recommendations", params={"limit": 51}, headers=auth).status_code == 422
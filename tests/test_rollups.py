@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+
+def practice(server, user_id, session_id, day, first_completion=True):
+    return {
+        **server.progress_key(user_id, session_id, None),
+        "practiced_at": f"{day}T07:30:00+00:00",
+        "first_completion": first_completion,
+    }
+
+
+def test_streaks_from_days(server):
+    assert server._streaks([]) == (0, 0)
+    assert server._streaks(["2024-05-01", "2024-05-02", "2024-05-02", "2024-05-03"]) == (3, 3)
+    assert server._streaks(["2024-04-01", "2024-04-02", "2024-04-03", "2024-05-10"]) == (1, 3)
+
+
+def test_rollup_pipeline_counts_streaks(server, run, catalog):
+    days = ["2024-05-01", "2024-05-02", "2024-05-02", "2024-05-04", "2024-05-05"]
+    for i, day in enumerate(days):
+        run(server.record_practice([practice(server, "u1", f"s{i + 1}", day)]))
+
+    rollup = run(server.db.progress_rollups.find_one({"user_id": "u1"}, {"_id": 0}))
+    assert rollup["completed_sessions"] == 5
+    assert rollup["minutes_practiced"] == sum(session["duration"] for session in catalog["sessions"])
+    assert (rollup["current_streak"], rollup["longest_streak"]) == (2, 2)
+    assert rollup["last_practice_date"] == "2024-05-05"
+
+
+def test_late_practice_does_not_reset_the_streak(server, run, catalog):
+    run(server.record_practice([practice(server, "u1", "s1", "2024-05-01"), practice(server, "u1", "s2", "2024-05-02")]))
+    run(server.record_practice([practice(server, "u1", "s3", "2024-04-20")]))
+
+    rollup = run(server.db.progress_rollups.find_one({"user_id": "u1"}))
+    assert (rollup["current_streak"], rollup["last_practice_date"]) == (2, "2024-05-02")
+
+
+def test_summary_zeroes_a_lapsed_streak(server, run, api, catalog, user, auth):
+    today = datetime.now(timezone.utc).date()
+    for offset in (2, 1):
+        day = (today - timedelta(days=offset)).isoformat()
+        run(server.record_practice([practice(server, user["id"], f"s{offset}", day)]))
+    assert api.get("/api/progress/summary", headers=auth).json()["current_streak"] == 2
+
+    run(server.db.progress_rollups.update_one(
+        {"user_id": user["id"]}, {"$set": {"last_practice_date": (today - timedelta(days=3)).isoformat()}}
+    ))
+    summary = api.get("/api/progress/summary", headers=auth).json()
+    assert summary["current_streak"] == 0
+    assert summary["longest_streak"] == 2
+
+
+def test_ranked_board_orders_by_score_then_user(server):
+    board = server.RankedBoard()
+    board.set("b", 10)
+    board.set("a", 10)
+    board.set("c", 30)
+    board.set("b", 40)
+    board.set("a", 0)
+    assert board.top(5) == [("b", 40), ("c", 30)]
+
+
+def test_leaderboard_sums_practice_minutes_this_week(server, run, catalog):
+    today = datetime.now(timezone.utc).date().isoformat()
+    run(server.record_practice([
+        practice(server, "u1", "s1", today),
+        practice(server, "u1", "s2", today),
+        practice(server, "u2", "s5", today),
+    ]))
+
+    minutes = dict(server.leaderboard.minutes.top(10))
+    durations = [session["duration"] for session in catalog["sessions"]]
+    assert minutes == {"u1": durations[0] + durations[1], "u2": durations[4]}
+
+
+def test_leaderboard_seeds_streaks_from_rollups(server, run):
+    today = datetime.now(timezone.utc).date()
+    run(server.db.progress_rollups.insert_many([
+        {"user_id": "active", "current_streak": 4, "last_practice_date": (today - timedelta(days=1)).isoformat()},
+        {"user_id": "lapsed", "current_streak": 9, "last_practice_date": (today - timedelta(days=5)).isoformat()},
+    ]))
+    run(server.leaderboard.load())
+
+    assert server.leaderboard.streaks.top(10) == [("active", 4)]
+
+
+def test_stop_waits_for_an_in_flight_checkpoint(server, run, catalog, monkeypatch):
+    today = datetime.now(timezone.utc).date().isoformat()
+    board = server.Leaderboard(0.01)
+    bulk_write = type(server.db.leaderboard).bulk_write
+    started = asyncio.Event()
+
+    async def slow_bulk_write(self, operations, ordered=True):
+        started.set()
+        await asyncio.sleep(0.05)
+        return await bulk_write(self, operations, ordered=ordered)
+
+    monkeypatch.setattr(type(server.db.leaderboard), "bulk_write", slow_bulk_write)
+
+    async def shutdown_mid_checkpoint():
+        board.start()
+        board.record([("u1", today, 30)])
+        await started.wait()
+        await board.stop()
+
+    run(shutdown_mid_checkpoint())
+    assert run(server.db.leaderboard.find_one({"_id": "u1"}))["minutes"] == 30
+    assert board._pending == {}
@@ -0,0 +1,46 @@
+def doc(doc_id, title, description="", category="Yoga"):
+    return {"id": doc_id, "title": title, "description": description, "category": category, "trainer_name": "Asha"}
+
+
+def test_title_matches_outrank_description_matches(server):
+    index = server.SearchIndex(2, 256, 10)
+    index.add(("session", "a"), doc("a", "Morning flow", "gentle sunrise practice"))
+    index.add(("session", "b"), doc("b", "Sunrise flow", "a morning favourite"))
+    index.add(("program", "c"), doc("c", "Evening wind down", "no match here"))
+
+    assert [d["id"] for _, d, _ in index.search("sunrise")] == ["b", "a"]
+    assert [d["id"] for _, d, _ in index.search("morning sunrise")] == ["a", "b"]
+    # Equal scores fall back to title order
+    assert [d["id"] for _, d, _ in index.search("flow")] == ["a", "b"]
+    assert [d["id"] for _, d, _ in index.search("asha", kind="program")] == ["c"]
+    assert index.search("flow sunset") == []
+
+
+def test_prefix_matching_limits(server):
+    index = server.SearchIndex(3, 2, 10)
+    for i, word in enumerate(["breathe", "breathwork", "breadth", "bridge"]):
+        index.add(("session", str(i)), doc(str(i), word.title()))
+
+    # Too short to expand: whole tokens only
+    assert index.search("br") == []
+    assert [(d["id"], score) for _, d, score in index.search("breathe")] == [("0", 3.0)]
+    # Tokens matched by prefix score half
+    assert [(d["id"], score) for _, d, score in index.search("breath")] == [("0", 1.5), ("1", 1.5)]
+    # "brea" expands to at most two tokens, in token order: breadth and breathe
+    assert sorted(d["id"] for _, d, _ in index.search("brea")) == ["0", "2"]
+
+
+def test_removed_documents_leave_the_index(server):
+    index = server.SearchIndex(2, 256, 10)
+    index.add(("session", "a"), doc("a", "Morning flow"))
+    assert index.search("morning")
+    index.remove(("session", "a"))
+    assert index.search("morning") == [] and index.tokens == []
+
+
+def test_search_endpoint(server, api, catalog):
+    results = api.get("/api/search", params={"q": "sess yoga"}).json()
+    assert [(r["type"], r["id"]) for r in results] == [("session", "s1"), ("session", "s3"), ("session", "s5")]
+    assert api.get("/api/search", params={"q": "yoga", "type": "program"}).json()[0]["id"] == "p1"
+    assert len(api.get("/api/search", params={"q": "session", "limit": 2}).json()) == 2
+    assert api.get("/api/search", params={"q": "yoga", "limit": server.SEARCH_MAX_LIMIT + 1}).status_code == 422
@@ -0,0 +1,101 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+from bson import Binary
+
+USER_ID = "2f1c7a4e-9b1d-4c55-a0a4-3c2d9e8f7b61"
+
+
+@pytest.fixture
+def compact(server, monkeypatch):
+    monkeypatch.setattr(server, "COMPACT_STORAGE", True)
+    return server
+
+
+def test_ids_and_times_round_trip(compact):
+    stored = compact.to_storage_id(USER_ID)
+    assert isinstance(stored, Binary)
+    assert compact.from_storage_id(stored) == USER_ID
+    # Ids that are not UUIDs are stored unchanged
+    assert compact.to_storage_id("seed-user") == "seed-user"
+
+    created_at = "2024-05-01T08:15:30.123000+00:00"
+    assert isinstance(compact.to_storage_time(created_at), datetime)
+    assert compact.from_storage_time(compact.to_storage_time(created_at)) == created_at
+
+
+def test_storage_now_compares_equal_after_a_round_trip(compact, run):
+    now = compact.storage_now()
+    run(compact.db.probe.insert_one({"_id": 1, "at": now}))
+    assert run(compact.db.probe.find_one({"_id": 1}))["at"] == now
+
+
+def test_user_round_trip(compact):
+    user = {"id": USER_ID, "email": "a@yoga.com", "name": "A", "created_at": "2024-05-01T08:00:00+00:00"}
+    stored = compact.user_to_storage(user)
+    assert "id" not in stored and stored["_id"] == Binary.from_uuid(uuid.UUID(USER_ID))
+    assert compact.user_from_storage(stored) == user
+
+
+def test_progress_round_trip(compact):
+    progress = {"id": str(uuid.uuid4()), "user_id": USER_ID, "completed_at": "2024-05-01T08:00:00+00:00"}
+    assert compact.progress_from_storage(compact.progress_to_storage(progress)) == progress
+
+
+def test_legacy_documents_read_unchanged(server):
+    user = {"id": USER_ID, "email": "a@yoga.com", "name": "A", "created_at": "2024-05-01T08:00:00+00:00"}
+    assert server.user_to_storage(user) is user
+    assert server.user_from_storage({"_id": "object-id", **user}) == user
+
+
+def test_user_loader_reads_both_storage_formats(server, run, monkeypatch):
+    monkeypatch.setattr(server, "COMPACT_STORAGE", True)
+    legacy_id, compact_id = "legacy-user", "7d0b5a9e-55c5-4d4e-8f9d-7fe1c2b3a4d5"
+    run(server.db.users.insert_one({"id": legacy_id, "email": "legacy@yoga.com", "name": "Legacy"}))
+    run(server.db.users.insert_one(server.user_to_storage({"id": compact_id, "email": "compact@yoga.com", "name": "Compact"})))
+
+    users = run(asyncio.gather(server.load_user(legacy_id), server.load_user(compact_id)))
+    assert [user["id"] for user in users] == [legacy_id, compact_id]
+    assert server.user_loader.queries == 1
+
+
+def test_migration_moves_users_and_progress(compact, run):
+    legacy = {"id": USER_ID, "email": "a@yoga.com", "name": "A", "created_at": "2024-05-01T08:00:00+00:00"}
+    run(compact.db.users.insert_one(dict(legacy)))
+    run(compact.db.progress.insert_one(
+        {"id": str(uuid.uuid4()), "user_id": USER_ID, "session_id": "s1", "completed_at": "2024-05-01T09:00:00+00:00"}
+    ))
+
+    report = run(compact.migrate_compact_storage())
+    assert (report["users_migrated"], report["progress_migrated"], report["users_failed"]) == (1, 1, [])
+
+    stored = run(compact.db.users.find_one({"email": "a@yoga.com"}))
+    assert stored["_id"] == compact.to_storage_id(USER_ID) and "id" not in stored
+    assert compact.user_from_storage(stored)["created_at"] == legacy["created_at"]
+    assert isinstance(run(compact.db.progress.find_one({}))["completed_at"], datetime)
+    assert run(compact.db.users_migration_backup.count_documents({})) == 0
+    # A second run has nothing left to move
+    assert run(compact.migrate_compact_storage())["users_migrated"] == 0
+
+
+def test_migration_resumes_a_user_lost_between_delete_and_insert(compact, run):
+    old = {"_id": "legacy-object-id", "id": USER_ID, "email": "a@yoga.com", "name": "A"}
+    run(compact.db.users_migration_backup.insert_one(old))
+
+    report = run(compact.migrate_compact_storage())
+    assert report["users_resumed"] == 1
+    user = run(compact.load_user(USER_ID))
+    assert user["email"] == "a@yoga.com"
+    assert run(compact.db.users_migration_backup.count_documents({})) == 0
+
+
+def test_migration_drops_a_backup_whose_user_was_never_deleted(compact, run):
+    old = {"_id": "legacy-object-id", "id": USER_ID, "email": "a@yoga.com", "name": "A"}
+    run(compact.db.users.insert_one(dict(old)))
+    run(compact.db.users_migration_backup.insert_one(dict(old)))
+
+    report = run(compact.migrate_compact_storage())
+    assert (report["users_resumed"], report["users_migrated"]) == (0, 1)
+    assert run(compact.db.users.count_documents({})) == 1